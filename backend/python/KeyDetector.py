@@ -1,56 +1,222 @@
-from typing import Optional
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import numpy as np
-import librosa
+from contextlib import asynccontextmanager
+import concurrent.futures
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import hashlib
 import logging
+import json
+import os
 from tempfile import NamedTemporaryFile
-import shutil
 import uvicorn
+import metrics
+import warmup
+from key_detection import (
+    KEY_DETECTION_MODE, KEY_DETECTION_MODES, SAMPLE_RATE,
+    detect_key_job, key_cache, key_params_hash, warm_up_key_detection,
+)
 
 logging.basicConfig(level=logging.INFO)
 
-NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G',
-              'G#', 'A', 'A#', 'B']
-SAMPLE_RATE = 44100
+UPLOAD_CHUNK_SIZE = 1 << 20
+KEY_WORKERS = int(os.environ.get("KEY_WORKERS", str(os.cpu_count() or 1)))
+KEY_START_METHOD = os.environ.get("KEY_START_METHOD", "spawn")
+KEY_BATCH_CONCURRENCY = int(os.environ.get("KEY_BATCH_CONCURRENCY", str(KEY_WORKERS)))
 
-app = FastAPI(title="Key Detection API")
+readiness = warmup.Readiness()
 
-def detect_key_librosa(audio_data: np.ndarray, sr: int):
-    chroma = librosa.feature.chroma_cqt(y=audio_data, sr=sr)
-    chroma_sum = np.sum(chroma, axis=1)
-    tonic_index = np.argmax(chroma_sum)
-    tonic_note = NOTE_NAMES[tonic_index]
-    major_intervals = [0, 4, 7]
-    minor_intervals = [0, 3, 7]
-    major_score = sum(chroma_sum[(tonic_index + i) % 12] for i in major_intervals)
-    minor_score = sum(chroma_sum[(tonic_index + i) % 12] for i in minor_intervals)
-    mode = "major" if major_score >= minor_score else "minor"
-    return f"{tonic_note} {mode}"
+def _init_key_worker():
+    logging.basicConfig(level=logging.INFO)
+    warmup.warm_worker(warm_up_key_detection)
+
+def _worker_ready():
+    return os.getpid()
+
+class KeyPool:
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self._executor = None
+        self._restarting = False
+
+    def start(self):
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(KEY_START_METHOD),
+            initializer=_init_key_worker,
+        )
+        pids = {f.result() for f in [self._executor.submit(_worker_ready) for _ in range(self.workers)]}
+        logging.info(f"Key detection pool ready with {len(pids)} worker process(es)")
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def _recover(self, broken):
+        # Jobs that were in flight on the dead pool all fail together; only the first one rebuilds it.
+        if not self._restarting and self._executor is broken:
+            self._restarting = True
+            try:
+                self.stop()
+                await asyncio.get_running_loop().run_in_executor(None, self.start)
+            finally:
+                self._restarting = False
+
+    async def run(self, fn, *args):
+        # Returns the job's (status, content, events), or a 503 in the same shape when no worker can take it.
+        executor = self._executor
+        if executor is None or self._restarting:
+            return 503, {"success": False, "message": "Key detection service is starting up, retry later"}, []
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        except BrokenProcessPool as e:
+            logging.error(f"Key detection worker crashed: {e}")
+            await self._recover(executor)
+            return 503, {"success": False, "message": "Key detection worker crashed, retry later"}, []
+
+key_pool = KeyPool(KEY_WORKERS)
+
+@asynccontextmanager
+async def lifespan(app):
+    startup = readiness.start([("key_pool", key_pool.start)])
+    yield
+    await startup
+    key_pool.stop()
+
+app = FastAPI(title="Key Detection API", lifespan=lifespan)
+metrics.install(app, "keydetect")
+warmup.install(app, readiness)
 
 class DetectResponse(BaseModel):
     success: bool
     detectedKey: Optional[str] = None
     message: Optional[str] = None
+    cached: Optional[bool] = None
+
+class BatchDetectRequest(BaseModel):
+    paths: List[str]
+    mode: Optional[str] = None
+
+def _bad_mode(mode):
+    return DetectResponse(success=False, message=f"unknown key detection mode '{mode}', expected one of {list(KEY_DETECTION_MODES)}")
+
+def remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+async def spool_upload(file: UploadFile):
+    content_hash = hashlib.sha256()
+    with NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                content_hash.update(chunk)
+                tmp.write(chunk)
+        except Exception:
+            tmp.close()
+            remove_quietly(tmp.name)
+            raise
+    return tmp.name, content_hash.hexdigest()
 
 @app.post("/keydetect", response_model=DetectResponse)
-async def upload_and_detect(file: UploadFile = File(...)):
+async def upload_and_detect(file: UploadFile = File(...), mode: Optional[str] = Form(None)):
+    if mode is not None and mode not in KEY_DETECTION_MODES:
+        return _bad_mode(mode)
+    tmp_path = None
     try:
-        with NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-            shutil.copyfileobj(file.file, tmp)
-            tmp_path = tmp.name
-        audio_data, sr = librosa.load(tmp_path, sr=SAMPLE_RATE, mono=True)
-        if len(audio_data) == 0:
-            raise HTTPException(status_code=400, detail="No audio data found.")
-        detected_key = detect_key_librosa(audio_data, sr)
+        tmp_path, content_hash = await spool_upload(file)
+        detected_key = key_cache.get(content_hash, key_params_hash(mode, SAMPLE_RATE))
+        cached = detected_key is not None
+        if not cached:
+            status, content, events = await key_pool.run(
+                detect_key_job, tmp_path, mode, content_hash,
+                metrics.request_id(), metrics.log_sampled(),
+            )
+            metrics.replay(events)
+            if status != 200:
+                raise RuntimeError(content["message"])
+            detected_key, cached = content["detectedKey"], content["cached"]
         return DetectResponse(
             success=True,
             detectedKey=detected_key,
-            message="Key detection successful."
+            message="Key detection successful.",
+            cached=cached,
         )
     except Exception as e:
-        logging.error(f"Error: {str(e)}")
+        logging.error(f"[{metrics.request_id()}] Error: {str(e)}")
+        return DetectResponse(success=False, message=str(e))
+    finally:
+        if tmp_path is not None:
+            remove_quietly(tmp_path)
+
+async def _batch_lines(items, mode, request_id=None, sampled=False, cleanup=()):
+    total = len(items)
+    yield json.dumps({"type": "start", "total": total, "mode": mode or KEY_DETECTION_MODE}) + "\n"
+    completed = failed = 0
+    pending = set()
+    queue = iter(items)
+    try:
+        while True:
+            while len(pending) < KEY_BATCH_CONCURRENCY:
+                item = next(queue, None)
+                if item is None:
+                    break
+                name, path, content_hash = item
+                fut = asyncio.ensure_future(key_pool.run(
+                    detect_key_job, path, mode, content_hash, request_id, sampled
+                ))
+                fut.item_name = name
+                pending.add(fut)
+            if not pending:
+                break
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in finished:
+                try:
+                    status, content, events = fut.result()
+                    metrics.replay(events)
+                except Exception as e:
+                    status, content = 500, {"success": False, "message": str(e)}
+                if status != 200:
+                    logging.error(f"[{request_id}] Error for {fut.item_name}: {content['message']}")
+                completed += 1
+                failed += int(status != 200)
+                yield json.dumps(dict(content, type="result", path=fut.item_name, status=status,
+                                      completed=completed, total=total)) + "\n"
+    finally:
+        for path in cleanup:
+            remove_quietly(path)
+    yield json.dumps({"type": "summary", "total": total, "completed": completed, "failed": failed}) + "\n"
+
+@app.post("/keydetect/batch")
+async def detect_batch(request: BatchDetectRequest):
+    if request.mode is not None and request.mode not in KEY_DETECTION_MODES:
+        return _bad_mode(request.mode)
+    items = [(path, path, None) for path in dict.fromkeys(request.paths)]
+    return StreamingResponse(_batch_lines(items, request.mode, metrics.request_id(), metrics.log_sampled()),
+                             media_type="application/x-ndjson")
+
+@app.post("/keydetect/batch/upload")
+async def detect_batch_upload(files: List[UploadFile] = File(...), mode: Optional[str] = Form(None)):
+    if mode is not None and mode not in KEY_DETECTION_MODES:
+        return _bad_mode(mode)
+    items = []
+    try:
+        for file in files:
+            tmp_path, content_hash = await spool_upload(file)
+            items.append((file.filename, tmp_path, content_hash))
+    except Exception as e:
+        for _, tmp_path, _ in items:
+            remove_quietly(tmp_path)
+        logging.error(f"[{metrics.request_id()}] Error: {str(e)}")
         return DetectResponse(success=False, message=str(e))
+    return StreamingResponse(_batch_lines(items, mode, metrics.request_id(), metrics.log_sampled(),
+                                          cleanup=[tmp_path for _, tmp_path, _ in items]),
+                             media_type="application/x-ndjson")
 
 if __name__ == "__main__":
     uvicorn.run("KeyDetector:app", host="0.0.0.0", port=8083)
\ No newline at end of file
@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+import numpy as np
+import librosa
+
+PCM_CACHE_DIR = os.environ.get("PCM_CACHE_DIR", "pcm_cache")
+PCM_CACHE_MAX_MB = int(os.environ.get("PCM_CACHE_MAX_MB", "2048"))
+PCM_RES_TYPE = "soxr_hq"
+HASH_CHUNK_SIZE = 1 << 20
+MAX_HASH_MEMO = 4096
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def decode(path, sr=None, mono=True):
+    return librosa.load(path, sr=sr, mono=mono, dtype=np.float32)
+
+
+class PCMCache:
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def content_hash(self, path):
+        st = os.stat(path)
+        stamp = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            digest = self._hashes.get(stamp)
+        if digest is None:
+            digest = file_sha256(path)
+            with self._lock:
+                if len(self._hashes) >= MAX_HASH_MEMO:
+                    self._hashes.clear()
+                self._hashes[stamp] = digest
+        return digest
+
+    def _entry_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.npy")
+
+    def _native_meta_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}-native.json")
+
+    def _open(self, name):
+        path = self._entry_path(name)
+        try:
+            y = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return y
+
+    def _store(self, name, y):
+        y = np.ascontiguousarray(y, dtype=np.float32)
+        if y.nbytes > self.max_bytes:
+            return y
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._entry_path(name)
+            tmp_path = f"{path[:-4]}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+            np.save(tmp_path, y)
+            os.replace(tmp_path, path)
+            self._evict(keep=path)
+            return np.load(path, mmap_mode="r")
+        except OSError as e:
+            logging.warning(f"Could not persist decoded audio {name}: {e}")
+            return y
+
+    def _evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npy") or ".tmp." in name:
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                if path.endswith("-native.npy"):
+                    os.remove(f"{path[:-4]}.json")
+            except OSError:
+                pass
+            total -= size
+
+    def _native_sr(self, digest):
+        try:
+            with open(self._native_meta_path(digest)) as f:
+                return int(json.load(f)["sr"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _native(self, path, digest):
+        sr_native = self._native_sr(digest)
+        y = self._open(f"{digest}-native") if sr_native else None
+        if y is None:
+            y, sr_native = librosa.load(path, sr=None, mono=False, dtype=np.float32)
+            y = self._store(f"{digest}-native", y)
+            meta_path = self._native_meta_path(digest)
+            try:
+                with open(f"{meta_path}.{os.getpid()}.tmp", "w") as f:
+                    json.dump({"sr": int(sr_native)}, f)
+                os.replace(f"{meta_path}.{os.getpid()}.tmp", meta_path)
+            except OSError as e:
+                logging.warning(f"Could not persist decoded audio metadata {meta_path}: {e}")
+        return y, sr_native
+
+    def load(self, path, sr=None, mono=True, content_hash=None):
+        if self.max_bytes <= 0:
+            return decode(path, sr=sr, mono=mono)
+        digest = content_hash or self.content_hash(path)
+        layout = "mono" if mono else "multi"
+        target_sr = sr or self._native_sr(digest)
+        if target_sr:
+            y = self._open(f"{digest}-{int(target_sr)}-{layout}")
+            if y is not None:
+                return y, target_sr
+        native, sr_native = self._native(path, digest)
+        target_sr = sr or sr_native
+        # Same to_mono -> resample chain as librosa.load, run on the cached native PCM.
+        y = librosa.to_mono(native) if mono else native
+        if target_sr != sr_native:
+            y = librosa.resample(y, orig_sr=sr_native, target_sr=target_sr, res_type=PCM_RES_TYPE)
+        if y is native:
+            return native, sr_native
+        if y.ndim == 1 and layout != "mono":
+            layout = "mono"
+            cached = self._open(f"{digest}-{int(target_sr)}-{layout}")
+            if cached is not None:
+                return cached, target_sr
+        return self._store(f"{digest}-{int(target_sr)}-{layout}", y), target_sr
+
+
+pcm_cache = PCMCache(PCM_CACHE_DIR, PCM_CACHE_MAX_MB * 1024 * 1024)
+
+
+def load(path, sr=None, mono=True, content_hash=None):
+    return pcm_cache.load(path, sr=sr, mono=mono, content_hash=content_hash)
@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+os.environ.setdefault("SCORING_WORKERS", "1")
+
+import numpy as np
+import soundfile as sf
+
+BENCH_SR = 22050
+LENGTHS = {"30s": 30, "3min": 180, "8min": 480}
+SCENARIOS = ("reference", "pitch", "drift", "silence", "noise")
+NOTE_SEC = 0.5
+PITCH_ERROR_RATE = 0.15
+DRIFT_RATE = 0.03
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+TIME_TOLERANCE = 0.5
+TIME_SLACK_SEC = 0.05
+MEMORY_TOLERANCE = 0.25
+MEMORY_SLACK_MB = 8.0
+
+
+def _voice(notes, note_sec, sr, rng):
+    out = []
+    for n in notes:
+        t = np.arange(int(note_sec * sr)) / sr
+        f0 = 440.0 * 2 ** ((n - 69) / 12) * (1.0 + 0.004 * np.sin(2 * np.pi * 5.5 * t))
+        phase = 2 * np.pi * np.cumsum(f0) / sr
+        env = np.minimum(1.0, np.minimum(t / 0.03, (note_sec - t) / 0.06))
+        tone = sum(np.sin(k * phase) / k for k in range(1, 6))
+        out.append(0.25 * env * tone)
+    y = np.concatenate(out)
+    return y + 0.003 * rng.standard_normal(len(y))
+
+
+def synth_fixture(scenario, seconds, sr=BENCH_SR, seed=0):
+    rng = np.random.default_rng(seed)
+    notes = rng.integers(57, 74, size=int(seconds / NOTE_SEC) + 1)
+    n = int(seconds * sr)
+    if scenario == "reference":
+        y = _voice(notes, NOTE_SEC, sr, rng)
+    elif scenario == "pitch":
+        wrong = rng.random(len(notes)) < PITCH_ERROR_RATE
+        notes = np.where(wrong, notes + rng.integers(2, 8, size=len(notes)), notes)
+        y = _voice(notes, NOTE_SEC, sr, rng)
+    elif scenario == "drift":
+        y = _voice(notes, NOTE_SEC * (1.0 + DRIFT_RATE), sr, rng)
+    elif scenario == "silence":
+        y = 1e-4 * rng.standard_normal(n)
+    elif scenario == "noise":
+        y = 0.2 * rng.standard_normal(n)
+    else:
+        raise ValueError(f"unknown scenario '{scenario}', expected one of {SCENARIOS}")
+    y = np.pad(y, (0, max(0, n - len(y))))[:n]
+    return y.astype(np.float32)
+
+
+def write_fixtures(target_dir, lengths):
+    os.makedirs(target_dir, exist_ok=True)
+    paths = {}
+    for label in lengths:
+        for scenario in SCENARIOS:
+            path = os.path.join(target_dir, f"{label}-{scenario}.wav")
+            if not os.path.isfile(path):
+                sf.write(path, synth_fixture(scenario, LENGTHS[label]), BENCH_SR)
+            paths[label, scenario] = path
+    return paths
+
+
+def measure(fn, *args, repeat=1):
+    tracemalloc.start()
+    result = fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best_wall = None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        wall = time.perf_counter() - t0
+        best_wall = wall if best_wall is None else min(best_wall, wall)
+    return result, {"wall_s": round(best_wall, 4), "peak_mb": round(peak / 2 ** 20, 2)}
+
+
+def run_stages(com5, paths, label, repeat):
+    ref_path, user_path = paths[label, "reference"], paths[label, "pitch"]
+    results = {}
+    (y_user, sr_user), results["decode"] = measure(com5.load_audio, user_path, False, repeat=repeat)
+    _, results["voiced_fraction_yin"] = measure(
+        com5.voiced_fraction_yin, y_user, sr_user, com5.YIN_WINDOWS, repeat=repeat)
+    ref_feats = com5.extract_chroma_from_song(ref_path)
+    user_feats, results["extract_chroma_from_song"] = measure(
+        com5.extract_chroma_from_song, user_path, repeat=repeat)
+    _, _, C_orig_raw, C_orig_unit, e_orig, _, _ = ref_feats
+    _, _, C_user_raw, C_user_unit, e_user, _, _ = user_feats
+    (_, path, _, _, _), results["dtw_calibrated_accuracy"] = measure(
+        com5.dtw_calibrated_accuracy, C_orig_unit, C_user_unit, repeat=repeat)
+    path_idx = com5.path_to_arrays(path)
+    _, results["detect_mistake_points"] = measure(
+        com5.detect_mistake_points, C_orig_unit, C_user_unit, path_idx, com5.SR, repeat=repeat)
+    thr_orig = float(np.percentile(e_orig, com5.VOICED_PCT_ORIG))
+    thr_user = float(np.percentile(e_user, com5.VOICED_PCT_USER))
+    _, results["note_agreement_score"] = measure(
+        com5.note_agreement_score, C_orig_raw, C_user_raw, path_idx,
+        e_orig, e_user, thr_orig, thr_user, repeat=repeat)
+    return results
+
+
+def worker_peak_mb():
+    import multiprocessing
+    peak = None
+    for proc in multiprocessing.active_children():
+        try:
+            with open(f"/proc/{proc.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        kb = int(line.split()[1])
+                        peak = max(peak or 0, kb)
+        except OSError:
+            continue
+    return None if peak is None else round(peak / 1024, 2)
+
+
+COMPARE_RUNS = (
+    ("compare_cold", "pitch"),
+    ("compare_pitch", "pitch"),
+    ("compare_drift", "drift"),
+    ("compare_silence", "silence"),
+    ("compare_noise", "noise"),
+)
+
+
+def run_compare(client, paths, label):
+    results = {}
+    for name, scenario in COMPARE_RUNS:
+        t0 = time.perf_counter()
+        resp = client.post("/compare", json={
+            "originalSongPath": paths[label, "reference"],
+            "userSongPath": paths[label, scenario],
+        })
+        wall = time.perf_counter() - t0
+        if resp.status_code != 200:
+            raise RuntimeError(f"/compare returned {resp.status_code} for {label}/{scenario}: {resp.text}")
+        results[name] = {"wall_s": round(wall, 4), "peak_mb": worker_peak_mb()}
+    return results
+
+
+def run_suite(lengths, repeat=1, compare=True, fixture_dir=None):
+    fixture_dir = fixture_dir or os.path.join(tempfile.gettempdir(), "singo-benchmark-fixtures")
+    paths = write_fixtures(fixture_dir, lengths)
+    # The services read their cache dirs from the environment at import, so com5 must not be loaded yet.
+    if "com5" in sys.modules:
+        raise RuntimeError("run_suite must import com5 itself so the benchmark starts with empty caches")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["FEATURE_CACHE_DIR"] = os.path.join(cache_dir, "features")
+        os.environ["PCM_CACHE_DIR"] = os.path.join(cache_dir, "pcm")
+        import com5
+        results = {}
+        for label in lengths:
+            for stage, stats in run_stages(com5, paths, label, repeat).items():
+                results[f"{label}/{stage}"] = stats
+        if compare:
+            from fastapi.testclient import TestClient
+            with TestClient(com5.app) as client:
+                for label in lengths:
+                    for stage, stats in run_compare(client, paths, label).items():
+                        results[f"{label}/{stage}"] = stats
+    return results
+
+
+def machine_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _mb(stats):
+    return "-" if stats["peak_mb"] is None else f"{stats['peak_mb']:.1f}"
+
+
+def compare_to_baseline(results, baseline):
+    regressions = []
+    lines = [f"{'stage':<38}{'wall_s':>10}{'base':>10}{'peak_mb':>10}{'base':>10}"]
+    for name, stats in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            lines.append(f"{name:<38}{stats['wall_s']:>10.3f}{'-':>10}{_mb(stats):>10}{'-':>10}  new")
+            continue
+        flags = []
+        if (stats["wall_s"] > base["wall_s"] * (1 + TIME_TOLERANCE)
+                and stats["wall_s"] - base["wall_s"] > TIME_SLACK_SEC):
+            flags.append(f"time +{100 * (stats['wall_s'] / max(base['wall_s'], 1e-9) - 1):.0f}%")
+        if (stats["peak_mb"] is not None and base["peak_mb"] is not None
+                and stats["peak_mb"] > base["peak_mb"] * (1 + MEMORY_TOLERANCE)
+                and stats["peak_mb"] - base["peak_mb"] > MEMORY_SLACK_MB):
+            flags.append(f"memory +{stats['peak_mb'] - base['peak_mb']:.1f}MB")
+        if flags:
+            regressions.append(name)
+        lines.append(f"{name:<38}{stats['wall_s']:>10.3f}{base['wall_s']:>10.3f}"
+                     f"{_mb(stats):>10}{_mb(base):>10}"
+                     f"  {'REGRESSION ' + ', '.join(flags) if flags else 'ok'}")
+    return regressions, "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage-level scoring benchmarks on synthetic fixtures")
+    parser.add_argument("--lengths", default=",".join(LENGTHS),
+                        help=f"comma separated subset of {', '.join(LENGTHS)}")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per stage after the traced warm-up run, best is kept")
+    parser.add_argument("--no-compare", action="store_true", help="skip the /compare handler stage")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--fixture-dir", default=None)
+    args = parser.parse_args(argv)
+    lengths = [l for l in args.lengths.split(",") if l]
+    unknown = [l for l in lengths if l not in LENGTHS]
+    if unknown:
+        parser.error(f"unknown lengths {unknown}, expected any of {list(LENGTHS)}")
+    results = run_suite(lengths, args.repeat, not args.no_compare, args.fixture_dir)
+    if args.update_baseline or not os.path.isfile(args.baseline):
+        baseline = {"machine": machine_info(), "results": results}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as f:
+                old = json.load(f)
+            baseline["results"] = dict(old.get("results", {}), **results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions, table = compare_to_baseline(results, baseline)
+    print(table)
+    if baseline.get("machine") != machine_info():
+        print(f"note: baseline recorded on {baseline.get('machine')}")
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,32 @@
+import os
+import re
+import json
+import uuid
+import asyncio
+import hashlib
+import multiprocessing
 import uvicorn
+import warmup
 import numpy as np
 import librosa
-from fastdtw import fastdtw
+import audioread
+import soundfile as sf
 import concurrent.futures
 import logging
-import noisereduce as nr
-from fastapi import FastAPI
+import metrics
+import audio_cache
+from contextlib import asynccontextmanager
+from concurrent.futures.process import BrokenProcessPool
+from feature_store import FeatureSet, ReferenceFeatureStore
+from dtw_engine import align, align_coarse_to_fine, fixed_segments, path_cost
+from spectral_features import extract_features_blockwise, harmonic_spectrum, pcm_blocks
+from online_dtw import OnlineAligner, StreamingFrameExtractor
+from typing import List, Optional
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 logging.basicConfig(level=logging.INFO)
-app = FastAPI()
 
 SR = 22050
 N_FFT = 2048
@@ -45,49 +61,233 @@ VOICED_PCT_ORIG = 25
 MIN_VOCAL_RMS = 0.0035
 PEAK_CHROMA_MIN = 1e-7
 
+DTW_ENGINE = os.environ.get("DTW_ENGINE", "banded")
+DTW_BAND = os.environ.get("DTW_BAND", "sakoe")
+DTW_BAND_RADIUS_SEC = float(os.environ.get("DTW_BAND_RADIUS_SEC", "8.0"))
+DTW_BAND_SLOPE = float(os.environ.get("DTW_BAND_SLOPE", "2.0"))
+
+ALIGN_MODES = ("full", "segment", "beat")
+ALIGN_MODE = os.environ.get("ALIGN_MODE", "full")
+ALIGN_SEGMENT_FRAMES = int(os.environ.get("ALIGN_SEGMENT_FRAMES", "8"))
+ALIGN_CORRIDOR_FRAMES = int(os.environ.get("ALIGN_CORRIDOR_FRAMES", "24"))
+
+SCORING_WORKERS = int(os.environ.get("SCORING_WORKERS", str(os.cpu_count() or 1)))
+SCORING_QUEUE_SIZE = int(os.environ.get("SCORING_QUEUE_SIZE", "16"))
+SCORING_TIMEOUT_SEC = float(os.environ.get("SCORING_TIMEOUT_SEC", "120"))
+SCORING_RETRY_AFTER_SEC = int(os.environ.get("SCORING_RETRY_AFTER_SEC", "5"))
+SCORING_START_METHOD = os.environ.get("SCORING_START_METHOD", "spawn")
+
+MIN_RECORDING_SEC = 30
+CASCADE_DECIMATE = 4
+CASCADE_MIN_PEAK_RMS = 0.004
+CASCADE_MAX_FLATNESS = 0.95
+YIN_WINDOWS = 8
+YIN_WINDOW_SEC = 3.0
+
+STREAM_MAX_SESSIONS = int(os.environ.get("STREAM_MAX_SESSIONS", "32"))
+STREAM_KEY_SEC = 8.0
+STREAM_BACK_SEC = 2.0
+STREAM_AHEAD_SEC = 4.0
+STREAM_ONSET_RMS = 0.01
+STREAM_MISTAKE_INTERVAL_SEC = 1.0
+
+BATCH_STATE_DIR = os.environ.get("BATCH_STATE_DIR", "batch_jobs")
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", str(SCORING_WORKERS)))
+
+FEATURE_ENGINE = os.environ.get("FEATURE_ENGINE", "shared_stft")
+FEATURE_VERSION = 2
+FEATURE_CACHE_DIR = os.environ.get("FEATURE_CACHE_DIR", "feature_cache")
+FEATURE_CACHE_MEM_MB = int(os.environ.get("FEATURE_CACHE_MEM_MB", "512"))
+FEATURE_SIDECAR_SUFFIX = os.environ.get("FEATURE_SIDECAR_SUFFIX", ".features")
+
+EXTRACTION_MODE = os.environ.get("EXTRACTION_MODE", "auto")
+BLOCKWISE_MIN_SEC = float(os.environ.get("BLOCKWISE_MIN_SEC", "300"))
+BLOCKWISE_BLOCK_SEC = 10.0
+
+def scoring_config_hash():
+    config = {
+        "feature_version": FEATURE_VERSION,
+        "feature_engine": FEATURE_ENGINE,
+        "sr": SR,
+        "n_fft": N_FFT,
+        "hop": HOP,
+        "noise_reduce": USE_NOISE_REDUCE,
+        "trim_top_db": TRIM_TOP_DB,
+        "extraction": [EXTRACTION_MODE, BLOCKWISE_MIN_SEC],
+        "alpha": ALPHA,
+        "dtw": [DTW_ENGINE, DTW_BAND, DTW_BAND_RADIUS_SEC, DTW_BAND_SLOPE],
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
 class CompareRequest(BaseModel):
     originalSongPath: str
     userSongPath: str
+    alignMode: Optional[str] = None
+
+class BatchCompareRequest(BaseModel):
+    originalSongPath: str
+    userSongPaths: List[str]
+    jobId: Optional[str] = None
+    alignMode: Optional[str] = None
 
 def _normalize_chroma_cols(C: np.ndarray) -> np.ndarray:
     C = np.asarray(C, dtype=np.float32)
     norms = np.linalg.norm(C, axis=0, keepdims=True) + 1e-8
     return C / norms
 
-def _fast_hybrid_distance_factory(alpha: float):
-    def dist(x, y):
-        dot = float(np.dot(x, y))
-        cos_d = 1.0 - dot
-        eu_d  = np.sqrt(max(0.0, 2.0 - 2.0 * dot))
-        return alpha * cos_d + (1.0 - alpha) * eu_d
-    return dist
-
-def extract_chroma_from_song(path):
-    y, sr = librosa.load(path, sr=SR, mono=True, dtype=np.float32)
-    y, _ = librosa.effects.trim(y, top_db=TRIM_TOP_DB)
-    if USE_NOISE_REDUCE:
-        y = nr.reduce_noise(y=y, sr=sr, prop_decrease=2.0)
-    y_harm, _ = librosa.effects.hpss(y)
-    chroma_raw = librosa.feature.chroma_stft(y=y_harm, sr=sr, n_fft=N_FFT, hop_length=HOP).astype(np.float32)
+@metrics.timed("decode")
+def load_audio(path, cached=True):
+    # User takes are one-off, so they skip the PCM cache instead of evicting reference stems.
+    y, sr = (audio_cache.load if cached else audio_cache.decode)(path, sr=SR, mono=True)
+    return np.ascontiguousarray(y, dtype=np.float32), sr
+
+def _extract_chroma_legacy(y, sr):
+    with metrics.stage("hpss"):
+        y_harm, _ = librosa.effects.hpss(y)
+    with metrics.stage("chroma"):
+        chroma_raw = librosa.feature.chroma_stft(y=y_harm, sr=sr, n_fft=N_FFT, hop_length=HOP).astype(np.float32)
+        rms = librosa.feature.rms(y=y, hop_length=HOP)[0]
+        spectral_flatness = librosa.feature.spectral_flatness(y=y, hop_length=HOP)[0]
+    return chroma_raw, rms, spectral_flatness
+
+def _extract_chroma_shared_stft(y, sr):
+    with metrics.stage("hpss"):
+        D = librosa.stft(y, n_fft=N_FFT, hop_length=HOP)
+        mag = np.abs(D)
+        D_harm = harmonic_spectrum(D)
+    with metrics.stage("chroma"):
+        chroma_raw = librosa.feature.chroma_stft(
+            S=np.abs(D_harm) ** 2, sr=sr, n_fft=N_FFT, hop_length=HOP
+        ).astype(np.float32)
+        del D, D_harm
+        rms = librosa.feature.rms(y=y, frame_length=N_FFT, hop_length=HOP)[0]
+        spectral_flatness = librosa.feature.spectral_flatness(S=mag)[0]
+    return chroma_raw, rms.astype(np.float32), spectral_flatness
+
+def extract_chroma_from_wave(y, sr):
+    with metrics.stage("denoise"):
+        y, _ = librosa.effects.trim(y, top_db=TRIM_TOP_DB)
+        if USE_NOISE_REDUCE:
+            import noisereduce as nr
+            y = nr.reduce_noise(y=y, sr=sr, prop_decrease=2.0)
+    if FEATURE_ENGINE == "legacy":
+        chroma_raw, rms, spectral_flatness = _extract_chroma_legacy(y, sr)
+    else:
+        chroma_raw, rms, spectral_flatness = _extract_chroma_shared_stft(y, sr)
     energy_vec = np.sum(chroma_raw, axis=0).astype(np.float32)
     chroma_norm = _normalize_chroma_cols(chroma_raw)
-    rms = librosa.feature.rms(y=y, hop_length=HOP)[0]
-    spectral_flatness = librosa.feature.spectral_flatness(y=y, hop_length=HOP)[0]
     return y, sr, chroma_raw, chroma_norm, energy_vec, rms, spectral_flatness
 
-def dtw_normalized_distance(A_unit, B_unit, alpha):
-    fast_dist = _fast_hybrid_distance_factory(alpha)
-    dist, path = fastdtw(A_unit.T, B_unit.T, dist=fast_dist)
+def use_blockwise(path, blockwise=None):
+    if blockwise is not None:
+        return blockwise
+    if EXTRACTION_MODE != "auto":
+        return EXTRACTION_MODE == "blockwise"
+    duration = audio_duration(path)
+    return duration is not None and duration >= BLOCKWISE_MIN_SEC
+
+@metrics.timed("blockwise_features")
+def extract_chroma_blockwise(path):
+    chroma_raw, rms, spectral_flatness = extract_features_blockwise(
+        path, SR, N_FFT, HOP, TRIM_TOP_DB,
+        denoise={"prop_decrease": 2.0} if USE_NOISE_REDUCE else None,
+        block_sec=BLOCKWISE_BLOCK_SEC,
+    )
+    energy_vec = np.sum(chroma_raw, axis=0).astype(np.float32)
+    chroma_norm = _normalize_chroma_cols(chroma_raw)
+    return None, SR, chroma_raw, chroma_norm, energy_vec, rms, spectral_flatness
+
+def extract_chroma_from_song(path, blockwise=None):
+    if use_blockwise(path, blockwise):
+        return extract_chroma_blockwise(path)
+    y, sr = load_audio(path)
+    return extract_chroma_from_wave(y, sr)
+
+def alignment_bounds(X_unit, align_mode, bpm=None):
+    n = X_unit.shape[1]
+    if align_mode == "beat":
+        env = librosa.onset.onset_strength(S=X_unit, sr=SR, hop_length=HOP)
+        if bpm is None:
+            bpm = float(librosa.feature.tempo(onset_envelope=env, sr=SR, hop_length=HOP)[0])
+        _, beats = librosa.beat.beat_track(onset_envelope=env, sr=SR, hop_length=HOP, bpm=bpm)
+        bounds = librosa.util.fix_frames(beats, x_min=0, x_max=n)
+        if len(bounds) > 2:
+            return bounds.astype(np.int64), bpm
+    return fixed_segments(n, ALIGN_SEGMENT_FRAMES), bpm
+
+@metrics.timed("dtw")
+def dtw_normalized_distance(A_unit, B_unit, alpha, engine=None, align_mode=None):
+    align_mode = align_mode or ALIGN_MODE
+    if align_mode not in ALIGN_MODES:
+        raise ValueError(f"unknown alignment mode '{align_mode}', expected one of {ALIGN_MODES}")
+    radius = int(DTW_BAND_RADIUS_SEC * SR / HOP)
+    if align_mode == "full":
+        dist, path = align(
+            A_unit, B_unit, alpha,
+            engine=engine or DTW_ENGINE,
+            band=DTW_BAND,
+            radius=radius,
+            slope=DTW_BAND_SLOPE,
+        )
+    else:
+        a_bounds, bpm = alignment_bounds(A_unit, align_mode)
+        b_bounds, _ = alignment_bounds(B_unit, align_mode, bpm=bpm)
+        frames_per_segment = A_unit.shape[1] / max(1, len(a_bounds) - 1)
+        dist, path = align_coarse_to_fine(
+            A_unit, B_unit, alpha, a_bounds, b_bounds, ALIGN_CORRIDOR_FRAMES,
+            band=DTW_BAND,
+            coarse_radius=max(1, int(np.ceil(radius / frames_per_segment))),
+            slope=DTW_BAND_SLOPE,
+        )
     nd = dist / max(1, len(path))
     return float(nd), path
 
-def dtw_calibrated_accuracy(A_unit, B_unit, alpha=ALPHA, k=K_DECAY):
-    nd_self, _  = dtw_normalized_distance(A_unit, A_unit, alpha)
-    nd_pair, path = dtw_normalized_distance(A_unit, B_unit, alpha)
+def dtw_calibrated_accuracy(A_unit, B_unit, alpha=ALPHA, k=K_DECAY, nd_self=None, align_mode=None):
+    if nd_self is None:
+        nd_self, _ = dtw_normalized_distance(A_unit, A_unit, alpha, align_mode="full")
+    nd_pair, path = dtw_normalized_distance(A_unit, B_unit, alpha, align_mode=align_mode)
     eff_nd = max(0.0, nd_pair - nd_self)
     acc = 100.0 * np.exp(-k * eff_nd)
     return float(np.clip(acc, 0.0, 100.0)), path, eff_nd, nd_self, nd_pair
 
+@metrics.timed("dtw")
+def path_calibrated_accuracy(A_unit, B_unit, path, nd_self, alpha=ALPHA, k=K_DECAY):
+    oi, ui = path_to_arrays(path)
+    nd_pair = path_cost(A_unit, B_unit, alpha, oi, ui) / max(1, len(oi))
+    eff_nd = max(0.0, nd_pair - nd_self)
+    acc = 100.0 * np.exp(-k * eff_nd)
+    return float(np.clip(acc, 0.0, 100.0)), eff_nd
+
+def build_reference_features(features):
+    _, sr, chroma_raw, chroma_unit, energy_vec, rms, flatness = features
+    nd_self, _ = dtw_normalized_distance(chroma_unit, chroma_unit, ALPHA, align_mode="full")
+    arrays = {
+        "chroma_raw": chroma_raw,
+        "chroma_unit": chroma_unit,
+        "energy": energy_vec,
+        "rms": np.asarray(rms, dtype=np.float32),
+        "flatness": np.asarray(flatness, dtype=np.float32),
+        "notes": np.argmax(chroma_unit, axis=0).astype(np.int16),
+    }
+    return FeatureSet(arrays, {"sr": int(sr), "nd_self": float(nd_self)})
+
+def compute_reference_features(path):
+    return build_reference_features(extract_chroma_from_song(path))
+
+reference_store = ReferenceFeatureStore(
+    FEATURE_CACHE_DIR, scoring_config_hash(), FEATURE_CACHE_MEM_MB * 1024 * 1024,
+    sidecar_suffix=FEATURE_SIDECAR_SUFFIX,
+)
+
+def write_feature_sidecar(path):
+    with metrics.collect() as events:
+        if not reference_store.sidecar_current(path):
+            reference_store.write_sidecar(path, compute_reference_features)
+    return events
+
+def feature_config_version():
+    return reference_store.config_version
+
 def is_harmonic(n1, n2):
     interval = abs(n1 - n2) % 12
     return interval in [0, 7, 5, 4, 3]
@@ -114,112 +314,149 @@ def classify_pitch_error(expected_midi, actual_midi):
         else:
             return "slightly-low", 1, f"Slightly low (-{abs_diff} semitones)"
 
-def compute_timing_penalty(path, sr, hop_length=HOP):
-    if not path or len(path) < 2:
+_PITCH_ERROR_TABLE = [classify_pitch_error(60, 60 + d) for d in range(-11, 12)]
+_PITCH_ERROR_REASONS = [None] + sorted({r for r, _, _ in _PITCH_ERROR_TABLE if r})
+_PITCH_ERROR_REASON_IDS = np.array(
+    [_PITCH_ERROR_REASONS.index(r) for r, _, _ in _PITCH_ERROR_TABLE], dtype=np.int8
+)
+
+def path_to_arrays(path):
+    if isinstance(path, tuple) and len(path) == 2 and isinstance(path[0], np.ndarray):
+        return path
+    idx = np.asarray(path, dtype=np.int64).reshape(-1, 2)
+    return idx[:, 0], idx[:, 1]
+
+def compute_timing_penalty(path_idx, sr, hop_length=HOP):
+    oi, ui = path_idx
+    if len(oi) < 2:
         return 0.0
-    delays = [(u - o) * hop_length / sr for o, u in path]
+    delays = (ui - oi) * hop_length / sr
     std = float(np.std(delays))
     penalty = min(std * TIMING_PENALTY_FACTOR, TIMING_MAX_PENALTY)
     return float(penalty)
 
-def detect_mistake_points(orig_unit, user_unit, path, sr,
+@metrics.timed("mistakes")
+def detect_mistake_points(orig_unit, user_unit, path_idx, sr,
                           hop_length=HOP, min_gap=MIN_GAP,
-                          energy_threshold=ENERGY_THRESH):
-    mistakes = []
-    cur = None
+                          energy_threshold=ENERGY_THRESH, orig_notes=None):
     e_user = np.sum(user_unit, axis=0)
     e_orig = np.sum(orig_unit, axis=0)
     thr_user = float(np.max(e_user)) * energy_threshold if len(e_user) > 0 else 0.01
     thr_orig = float(np.max(e_orig)) * energy_threshold if len(e_orig) > 0 else 0.01
 
-    for oi, ui in path:
-        if oi >= orig_unit.shape[1] or ui >= user_unit.shape[1]:
+    oi, ui = path_idx
+    keep = (oi < orig_unit.shape[1]) & (ui < user_unit.shape[1])
+    oi, ui = oi[keep], ui[keep]
+    if len(oi) == 0:
+        return []
+    if orig_notes is None:
+        orig_notes = np.argmax(orig_unit, axis=0)
+    exp_idx = np.asarray(orig_notes)[oi].astype(np.int64)
+    act_idx = np.argmax(user_unit, axis=0)[ui].astype(np.int64)
+    t = ui * hop_length / sr
+    gated = ((e_orig[oi].astype(np.float64) > thr_orig)
+             & (e_user[ui].astype(np.float64) > thr_user))
+    diff_idx = act_idx - exp_idx + 11
+    rid = np.where(gated, _PITCH_ERROR_REASON_IDS[diff_idx], 0)
+
+    breaks = np.flatnonzero(
+        (rid[1:] != rid[:-1]) | ((rid[1:] > 0) & (np.diff(t) >= min_gap))
+    ) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(rid)]))
+    mistakes = []
+    for s, e in zip(starts.tolist(), ends.tolist()):
+        if rid[s] == 0:
             continue
-        eu = float(e_user[ui])
-        eo = float(e_orig[oi])
-        t = ui * hop_length / sr
-        exp_idx = int(np.argmax(orig_unit[:, oi]))
-        act_idx = int(np.argmax(user_unit[:, ui]))
-        exp_midi = 60 + exp_idx
-        act_midi = 60 + act_idx
-        reason = None
-        severity = 0
-        description = ""
-        if eo > thr_orig and eu > thr_user:
-            reason, severity, description = classify_pitch_error(exp_midi, act_midi)
-        if reason:
-            if cur and cur['reason'] == reason and (t - cur['end_time']) < min_gap:
-                cur['end_time'] = t
-                cur['frames'] += 1
-                cur['severity'] = max(cur['severity'], severity)
-            else:
-                if cur:
-                    dur = cur['end_time'] - cur['start_time']
-                    if dur >= min_gap:
-                        mistakes.append({**cur, "duration": round(dur, 2)})
-                cur = {
-                    "start_time": t,
-                    "end_time": t,
-                    "expected_note": exp_idx,
-                    "actual_note": act_idx,
-                    "expected_midi": exp_midi,
-                    "actual_midi": act_midi,
-                    "semitone_diff": act_midi - exp_midi,
-                    "reason": reason,
-                    "severity": severity,
-                    "description": description,
-                    "frames": 1
-                }
-        else:
-            if cur:
-                dur = cur['end_time'] - cur['start_time']
-                if dur >= min_gap:
-                    mistakes.append({**cur, "duration": round(dur, 2)})
-                cur = None
-    if cur:
-        dur = cur['end_time'] - cur['start_time']
-        if dur >= min_gap:
-            mistakes.append({**cur, "duration": round(dur, 2)})
+        start_time = float(t[s])
+        end_time = float(t[e - 1])
+        dur = end_time - start_time
+        if dur < min_gap:
+            continue
+        reason, severity, description = _PITCH_ERROR_TABLE[diff_idx[s]]
+        exp_midi = 60 + int(exp_idx[s])
+        act_midi = 60 + int(act_idx[s])
+        mistakes.append({
+            "start_time": start_time,
+            "end_time": end_time,
+            "expected_note": int(exp_idx[s]),
+            "actual_note": int(act_idx[s]),
+            "expected_midi": exp_midi,
+            "actual_midi": act_midi,
+            "semitone_diff": act_midi - exp_midi,
+            "reason": reason,
+            "severity": severity,
+            "description": description,
+            "frames": e - s,
+            "duration": round(dur, 2),
+        })
     return mistakes
 
-def note_agreement_score(orig_raw, user_raw, path, e_orig, e_user, thr_orig, thr_user):
-    correct_notes = 0
-    total_notes = 0
-    note_scores = []
-    pitch_errors = []
-    for oi, ui in path:
-        if (0 <= oi < orig_raw.shape[1] and 0 <= ui < user_raw.shape[1]
-            and e_orig[oi] > thr_orig and e_user[ui] > thr_user):
-            exp_idx = int(np.argmax(orig_raw[:, oi]))
-            act_idx = int(np.argmax(user_raw[:, ui]))
-            peak_u = float(np.max(user_raw[:, ui])) + 1e-8
-            correct_energy = float(user_raw[exp_idx, ui]) / peak_u
-            note_scores.append(correct_energy)
-            pitch_error = abs(exp_idx - act_idx)
-            pitch_errors.append(pitch_error)
-            if act_idx == exp_idx or (correct_energy > 0.6):
-                correct_notes += 1
-            total_notes += 1
-    if not note_scores:
+@metrics.timed("note_agreement")
+def note_agreement_score(orig_raw, user_raw, path_idx, e_orig, e_user, thr_orig, thr_user):
+    oi, ui = path_idx
+    keep = ((oi >= 0) & (oi < orig_raw.shape[1]) & (ui >= 0) & (ui < user_raw.shape[1]))
+    oi, ui = oi[keep], ui[keep]
+    voiced = ((e_orig[oi].astype(np.float64) > thr_orig)
+              & (e_user[ui].astype(np.float64) > thr_user))
+    oi, ui = oi[voiced], ui[voiced]
+    total_notes = len(oi)
+    if total_notes == 0:
         return 0.0, 0, 0.0, 0.0
+    exp_idx = np.argmax(orig_raw, axis=0)[oi]
+    act_idx = np.argmax(user_raw, axis=0)[ui]
+    peak_u = np.max(user_raw, axis=0)[ui].astype(np.float64) + 1e-8
+    note_scores = user_raw[exp_idx, ui].astype(np.float64) / peak_u
+    pitch_errors = np.abs(exp_idx - act_idx).astype(np.int64)
+    correct_notes = int(np.count_nonzero((act_idx == exp_idx) | (note_scores > 0.6)))
     nas_mean = float(np.mean(note_scores))
     avg_pitch_error = float(np.mean(pitch_errors))
-    correct_pct = correct_notes / total_notes if total_notes > 0 else 0.0
+    correct_pct = correct_notes / total_notes
     return nas_mean, total_notes, avg_pitch_error, correct_pct
 
+def voiced_frame_count(path_idx, e_orig, e_user, thr_orig, thr_user):
+    oi, ui = path_idx
+    keep = (oi < len(e_orig)) & (ui < len(e_user))
+    oi, ui = oi[keep], ui[keep]
+    return int(np.count_nonzero(
+        (e_orig[oi].astype(np.float64) > thr_orig) & (e_user[ui].astype(np.float64) > thr_user)
+    ))
+
 def freq_from_midi(m):
     return 440.0 * (2 ** ((m - 69) / 12))
 
-def energy_correlation_along_path(eo, eu, path):
-    xs, ys = [], []
-    for oi, ui in path:
-        if 0 <= oi < len(eo) and 0 <= ui < len(eu):
-            xs.append(float(eo[oi]))
-            ys.append(float(eu[ui]))
-    if len(xs) < 3:
+def format_mistake(m):
+    reason = m["reason"]
+    duration = m["duration"]
+    st = m.get("start_time", 0.0)
+    et = st + duration
+    severity = m.get("severity", 1)
+    description = m.get("description", "")
+    if reason == 'missing':
+        pitch_diff = 0.0
+    else:
+        exp_midi = m.get('expected_midi', 60)
+        act_midi = m.get('actual_midi', 60)
+        pitch_diff = abs(freq_from_midi(exp_midi) - freq_from_midi(act_midi))
+    return {
+        "reason": reason,
+        "description": description,
+        "severity": severity,
+        "start_time": round(st, 2),
+        "end_time": round(et, 2),
+        "duration": duration,
+        "semitone_difference": m.get("semitone_diff", 0),
+        "pitch_diff": round(pitch_diff, 2),
+        "frames": m.get("frames", 0)
+    }
+
+def energy_correlation_along_path(eo, eu, path_idx):
+    oi, ui = path_idx
+    keep = (oi >= 0) & (oi < len(eo)) & (ui >= 0) & (ui < len(eu))
+    if np.count_nonzero(keep) < 3:
         return 0.0
-    xs = np.asarray(xs, np.float32)
-    ys = np.asarray(ys, np.float32)
+    xs = np.asarray(eo)[oi[keep]].astype(np.float32)
+    ys = np.asarray(eu)[ui[keep]].astype(np.float32)
     xs -= xs.mean()
     ys -= ys.mean()
     denom = (np.linalg.norm(xs) * np.linalg.norm(ys)) + 1e-8
@@ -254,16 +491,27 @@ def detect_vocal_quality(rms, spectral_flatness, chroma_raw):
     quality_score = min(1.0, quality_score * 1.25)
     return True, float(quality_score), "Valid vocal detected"
 
-def extract_chroma_with_wave(path):
-    y, sr = librosa.load(path, sr=SR, mono=True, dtype=np.float32)
-    y, sr2, chroma_raw, chroma_norm, energy_vec, rms, flat = extract_chroma_from_song(path)
-    return y, sr2, chroma_raw, chroma_norm, energy_vec, rms, flat
-
-def voiced_fraction_yin(y, sr):
+def _yin_f0(y, sr):
     fmin = librosa.note_to_hz("C2")
     fmax = librosa.note_to_hz("C7")
-    f0 = librosa.yin(y, fmin=fmin, fmax=fmax, sr=sr,
-                     frame_length=N_FFT, hop_length=HOP)
+    return librosa.yin(y, fmin=fmin, fmax=fmax, sr=sr,
+                       frame_length=N_FFT, hop_length=HOP)
+
+def read_windows(path, duration, windows=YIN_WINDOWS, window_sec=YIN_WINDOW_SEC):
+    offsets = np.linspace(0.0, max(0.0, duration - window_sec), windows)
+    return np.concatenate([
+        librosa.load(path, sr=SR, mono=True, offset=float(o), duration=window_sec, dtype=np.float32)[0]
+        for o in offsets
+    ])
+
+@metrics.timed("yin")
+def voiced_fraction_yin(y, sr, windows=None, window_sec=YIN_WINDOW_SEC):
+    win = int(window_sec * sr)
+    if windows and len(y) > windows * win:
+        starts = np.linspace(0, len(y) - win, windows).astype(np.int64)
+        f0 = np.concatenate([_yin_f0(y[s:s + win], sr) for s in starts])
+    else:
+        f0 = _yin_f0(y, sr)
     voiced_mask = np.isfinite(f0)
     voiced_frac = float(np.mean(voiced_mask)) if f0.size else 0.0
     median_f0 = float(np.nanmedian(f0)) if np.any(voiced_mask) else 0.0
@@ -272,233 +520,735 @@ def voiced_fraction_yin(y, sr):
         median_f0 = 0.0
     return voiced_frac, median_f0
 
-@app.post("/compare")
-async def compare(request: CompareRequest):
+def audio_duration(path):
     try:
-        y_user, sr_user = librosa.load(
-            request.userSongPath, sr=SR, mono=True, dtype=np.float32
-        )
-        vf, f0_med = voiced_fraction_yin(y_user, sr_user)
-        logging.info(f"[YIN gate] voiced_frac={vf:.3f}  median_f0={f0_med:.1f} Hz")
-        if vf < 0.10 or f0_med < 80:
-            return JSONResponse({
-                "success": True,
-                "data": {
-                    "mistakes": [],
-                    "finalScore": 0.0,
-                    "qualityTier": "No Singing Detected",
-                    "message": "No valid singing detected (likely background hum or silence)."
-                }
-            })
-        if vf < 0.10:
-            return JSONResponse({
-                "success": True,
-                "data": {
-                    "mistakes": [],
-                    "finalScore": 0.0,
-                    "qualityTier": "No Singing Detected",
-                    "message": "No voiced singing detected in your recording."
-                }
-            })
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as ex:
-            f1 = ex.submit(extract_chroma_from_song, request.originalSongPath)
-            f2 = ex.submit(extract_chroma_from_song, request.userSongPath)
-            _, sr1, C_orig_raw, C_orig_unit, e_orig, rms_orig, flat_orig = f1.result()
-            _, sr2, C_user_raw, C_user_unit, e_user, rms_user, flat_user = f2.result()
-        is_valid, vocal_quality, quality_reason = detect_vocal_quality(rms_user, flat_user, C_user_raw)
-        total_energy = float(np.sum(rms_user))
-        avg_rms = float(np.mean(rms_user))
-        peak_chroma = float(np.max(C_user_raw))
-        logging.info(f"Silence check | total_energy={total_energy:.6f} | avg_rms={avg_rms:.6f} | peak_chroma={peak_chroma:.6e}")
-        if total_energy < 0.5 or avg_rms < 0.0015 or peak_chroma < 1e-6:
-            logging.warning("Rejected: no significant vocal energy detected.")
-            return JSONResponse({
-                "success": True,
-                "data": {
-                    "mistakes": [],
-                    "finalScore": 0.0,
-                    "qualityTier": "No Singing Detected",
-                    "message": "Your recording contains no audible singing or voice energy."
-                }
-            })
-        if not is_valid:
-            logging.warning(f"Invalid vocal detected: {quality_reason}")
-            return JSONResponse({
-                "success": True,
-                "data": {
-                    "mistakes": [],
-                    "finalScore": 0.0,
-                    "qualityTier": "Invalid Recording",
-                    "message": quality_reason,
-                    "debug": {
-                        "is_valid_vocal": False,
-                        "vocal_quality_score": round(vocal_quality, 3),
-                        "rejection_reason": quality_reason,
-                        "avg_rms": round(float(np.mean(rms_user)), 4),
-                        "avg_spectral_flatness": round(float(np.mean(flat_user)), 3)
-                    }
+        return float(sf.info(path).duration)
+    except Exception:
+        pass
+    try:
+        with audioread.audio_open(path) as f:
+            return float(f.duration)
+    except Exception:
+        return None
+
+def _coarse_frames(y, decimate=CASCADE_DECIMATE):
+    y_dec = np.ascontiguousarray(y[::decimate])
+    frame = max(64, N_FFT // decimate)
+    hop = max(16, HOP // decimate)
+    rms = librosa.feature.rms(y=y_dec, frame_length=frame, hop_length=hop)[0]
+    flatness = librosa.feature.spectral_flatness(y=y_dec, n_fft=frame, hop_length=hop)[0]
+    return rms, flatness
+
+def coarse_level_stats(y, decimate=CASCADE_DECIMATE):
+    rms, flatness = _coarse_frames(y, decimate)
+    peak_rms = float(np.max(rms)) if rms.size else 0.0
+    mean_flatness = float(np.mean(flatness)) if flatness.size else 1.0
+    return peak_rms, mean_flatness
+
+def coarse_level_stats_blockwise(path, decimate=CASCADE_DECIMATE):
+    peak_rms, flat_sum, n_frames = 0.0, 0.0, 0
+    for y in pcm_blocks(path, SR, BLOCKWISE_BLOCK_SEC):
+        if len(y) < N_FFT:
+            continue
+        rms, flatness = _coarse_frames(y, decimate)
+        peak_rms = max(peak_rms, float(np.max(rms)))
+        flat_sum += float(np.sum(flatness))
+        n_frames += flatness.size
+    return peak_rms, (flat_sum / n_frames if n_frames else 1.0)
+
+def _rejection(quality_tier, message, **extra):
+    data = {
+        "mistakes": [],
+        "finalScore": 0.0,
+        "qualityTier": quality_tier,
+        "message": message,
+    }
+    data.update(extra)
+    return {"success": True, "data": data}
+
+def _too_short_payload(reason="too_short"):
+    metrics.rejected(reason)
+    return _rejection("Recording Too Short, Need at least 45 seconds.",
+                      "No clear singing detected in your recording.")
+
+def _level_gate(peak_rms, mean_flatness):
+    if peak_rms < CASCADE_MIN_PEAK_RMS:
+        metrics.rejected("level")
+        metrics.debug("Rejected by level gate: peak_rms=%.5f", peak_rms)
+        return _rejection("No Singing Detected",
+                          "Your recording contains no audible singing or voice energy.")
+    if mean_flatness > CASCADE_MAX_FLATNESS:
+        metrics.rejected("flatness")
+        metrics.debug("Rejected by flatness gate: flatness=%.3f", mean_flatness)
+        return _rejection("Invalid Recording",
+                          "Audio is mostly noise, no clear vocals detected")
+    return None
+
+def _yin_gate(y, sr, windows=YIN_WINDOWS):
+    vf, f0_med = voiced_fraction_yin(y, sr, windows=windows)
+    metrics.debug("[YIN gate] voiced_frac=%.3f  median_f0=%.1f Hz", vf, f0_med)
+    if vf < 0.10 or f0_med < 80:
+        metrics.rejected("yin")
+        return _rejection("No Singing Detected",
+                          "No valid singing detected (likely background hum or silence).")
+    return None
+
+def score_recording(original_path, user_path, align_mode=None):
+    duration = audio_duration(user_path)
+    if duration is not None and duration < MIN_RECORDING_SEC:
+        metrics.debug("Rejected before decode: duration=%.2fs", duration)
+        return _too_short_payload("duration")
+    if duration is not None and use_blockwise(user_path):
+        return _score_recording_blockwise(original_path, user_path, duration, align_mode)
+    y_user, sr_user = load_audio(user_path, cached=False)
+    rejected = _level_gate(*coarse_level_stats(y_user))
+    if rejected is None:
+        rejected = _yin_gate(y_user, sr_user)
+    if rejected is not None:
+        return rejected
+    ref = reference_store.get(original_path, compute_reference_features)
+    _, _, C_user_raw, C_user_unit, e_user, rms_user, flat_user = extract_chroma_from_wave(y_user, sr_user)
+    if len(e_user) * HOP / SR < MIN_RECORDING_SEC:
+        return _too_short_payload()
+    return score_user_features(ref, C_user_raw, C_user_unit, e_user, rms_user, flat_user,
+                               align_mode=align_mode)
+
+def _score_recording_blockwise(original_path, user_path, duration, align_mode=None):
+    rejected = _level_gate(*coarse_level_stats_blockwise(user_path))
+    if rejected is None:
+        rejected = _yin_gate(read_windows(user_path, duration), SR, windows=None)
+    if rejected is not None:
+        return rejected
+    _, _, C_user_raw, C_user_unit, e_user, rms_user, flat_user = extract_chroma_blockwise(user_path)
+    if len(e_user) * HOP / SR < MIN_RECORDING_SEC:
+        return _too_short_payload()
+    ref = reference_store.get(original_path, compute_reference_features)
+    return score_user_features(ref, C_user_raw, C_user_unit, e_user, rms_user, flat_user,
+                               align_mode=align_mode)
+
+@metrics.timed("scoring")
+def score_user_features(ref, C_user_raw, C_user_unit, e_user, rms_user, flat_user,
+                        key_shift=None, path=None, align_mode=None):
+    sr1 = ref.meta["sr"]
+    C_orig_raw, C_orig_unit, e_orig = ref["chroma_raw"], ref["chroma_unit"], ref["energy"]
+    is_valid, vocal_quality, quality_reason = detect_vocal_quality(rms_user, flat_user, C_user_raw)
+    total_energy = float(np.sum(rms_user))
+    avg_rms = float(np.mean(rms_user))
+    peak_chroma = float(np.max(C_user_raw))
+    metrics.debug("Silence check | total_energy=%.6f | avg_rms=%.6f | peak_chroma=%.6e",
+                  total_energy, avg_rms, peak_chroma)
+    if total_energy < 0.5 or avg_rms < 0.0015 or peak_chroma < 1e-6:
+        metrics.rejected("silence")
+        metrics.debug("Rejected: no significant vocal energy detected.")
+        return {
+            "success": True,
+            "data": {
+                "mistakes": [],
+                "finalScore": 0.0,
+                "qualityTier": "No Singing Detected",
+                "message": "Your recording contains no audible singing or voice energy."
+            }
+        }
+    if not is_valid:
+        metrics.rejected("invalid_vocal")
+        metrics.debug("Invalid vocal detected: %s", quality_reason)
+        return {
+            "success": True,
+            "data": {
+                "mistakes": [],
+                "finalScore": 0.0,
+                "qualityTier": "Invalid Recording",
+                "message": quality_reason,
+                "debug": {
+                    "is_valid_vocal": False,
+                    "vocal_quality_score": round(vocal_quality, 3),
+                    "rejection_reason": quality_reason,
+                    "avg_rms": round(float(np.mean(rms_user)), 4),
+                    "avg_spectral_flatness": round(float(np.mean(flat_user)), 3)
                 }
-            })
+            }
+        }
+    if key_shift is None:
         key_o = int(np.argmax(np.sum(C_orig_unit, axis=1)))
         key_u = int(np.argmax(np.sum(C_user_unit, axis=1)))
         shift = key_u - key_o
-        C_user_unit = np.roll(C_user_unit, -shift, axis=0)
-        C_user_raw  = np.roll(C_user_raw,  -shift, axis=0)
+    else:
+        shift = key_shift
+    C_user_unit = np.roll(C_user_unit, -shift, axis=0)
+    C_user_raw  = np.roll(C_user_raw,  -shift, axis=0)
+    streamed = path is not None
+    if path is None:
         accuracy, path, eff_nd, nd_self, nd_pair = dtw_calibrated_accuracy(
-            C_orig_unit, C_user_unit, alpha=ALPHA, k=K_DECAY
+            C_orig_unit, C_user_unit, alpha=ALPHA, k=K_DECAY, nd_self=ref.meta["nd_self"],
+            align_mode=align_mode,
         )
-        mistakes = []
-        for m in detect_mistake_points(C_orig_unit, C_user_unit, path, sr1):
-            reason = m["reason"]
-            duration = m["duration"]
-            st = m.get("start_time", 0.0)
-            et = st + duration
-            severity = m.get("severity", 1)
-            description = m.get("description", "")
-            if reason == 'missing':
-                pitch_diff = 0.0
-            else:
-                exp_midi = m.get('expected_midi', 60)
-                act_midi = m.get('actual_midi', 60)
-                pitch_diff = abs(freq_from_midi(exp_midi) - freq_from_midi(act_midi))
-            mistakes.append({
-                "reason": reason,
-                "description": description,
-                "severity": severity,
-                "start_time": round(st, 2),
-                "end_time": round(et, 2),
-                "duration": duration,
-                "semitone_difference": m.get("semitone_diff", 0),
-                "pitch_diff": round(pitch_diff, 2),
-                "frames": m.get("frames", 0)
-            })
-        mistake_frames = int(sum(m['frames'] for m in mistakes))
-        total_mistakes = len(mistakes)
-        thr_user = float(np.percentile(e_user, VOICED_PCT_USER)) if len(e_user) > 0 else 0.01
-        thr_orig = float(np.percentile(e_orig, VOICED_PCT_ORIG)) if len(e_orig) > 0 else 0.01
-        voiced_frames = sum(
-            1 for oi, ui in path
-            if (oi < len(e_orig) and ui < len(e_user) and 
-                e_orig[oi] > thr_orig and e_user[ui] > thr_user)
+    else:
+        accuracy, eff_nd = path_calibrated_accuracy(
+            C_orig_unit, C_user_unit, path, ref.meta["nd_self"], alpha=ALPHA, k=K_DECAY
         )
-        if voiced_frames > 0:
-            ratio = min(1.0, mistake_frames / max(1, voiced_frames))
-            base_accuracy = 100.0 * (1.0 - MISTAKE_SLOPE * ratio)
+    path_idx = path_to_arrays(path)
+    mistakes = [format_mistake(m) for m in detect_mistake_points(
+        C_orig_unit, C_user_unit, path_idx, sr1, orig_notes=ref["notes"]
+    )]
+    mistake_frames = int(sum(m['frames'] for m in mistakes))
+    total_mistakes = len(mistakes)
+    thr_user = float(np.percentile(e_user, VOICED_PCT_USER)) if len(e_user) > 0 else 0.01
+    thr_orig = float(np.percentile(e_orig, VOICED_PCT_ORIG)) if len(e_orig) > 0 else 0.01
+    voiced_frames = voiced_frame_count(path_idx, e_orig, e_user, thr_orig, thr_user)
+    if voiced_frames > 0:
+        ratio = min(1.0, mistake_frames / max(1, voiced_frames))
+        base_accuracy = 100.0 * (1.0 - MISTAKE_SLOPE * ratio)
+    else:
+        base_accuracy = 0.0
+    nas, nas_count, avg_pitch_error, correct_pct = note_agreement_score(
+        C_orig_raw, C_user_raw, path_idx, e_orig, e_user, thr_orig, thr_user
+    )
+    nas_score = 100.0 * nas
+    timing_penalty = compute_timing_penalty(path_idx, sr1, hop_length=HOP)
+    key_penalty = abs(shift) * KEY_SHIFT_PENALTY_PER_STEP
+    r = energy_correlation_along_path(e_orig, e_user, path_idx)
+    energy_corr_penalty = (1.0 - max(0.0, r)) * 3.5
+    mistake_penalty = total_mistakes * MISTAKE_PENALTY_WEIGHT
+    if total_mistakes > 0:
+        mistake_penalty *= 1.2
+    if total_mistakes > 10:
+        mistake_penalty *= 1.4
+    if total_mistakes > 20:
+        mistake_penalty *= 1.5
+    mistake_ratio = mistake_frames / max(1, voiced_frames) if voiced_frames > 0 else 0.0
+    base_score = (W_ACC * accuracy + W_NAS * nas_score + W_BASE * base_accuracy)
+    penalized_score = base_score - timing_penalty - key_penalty - energy_corr_penalty - mistake_penalty
+    is_self_match = (eff_nd < 0.08 and mistake_ratio < 0.02 and accuracy > 98 and total_mistakes == 0)
+    if is_self_match:
+        final = 99.0 + min(1.0, (100.0 - penalized_score) / 10.0)
+        quality_tier = "Perfect Match"
+    else:
+        pitch_quality = max(0.0, 1.0 - (avg_pitch_error / 5.0))
+        note_quality = correct_pct
+        overall_quality = (0.5 * pitch_quality + 0.5 * note_quality)
+        overall_quality *= vocal_quality
+        centered = penalized_score - 50.0
+        spread_score = 50.0 + (centered * SCORE_SPREAD_FACTOR)
+        metrics.debug("Spread Score: %s, Centered: %s", spread_score, centered)
+        if overall_quality > 0.75 and mistake_ratio < 0.20 and total_mistakes < 15:
+            final = spread_score + 10.0
+            quality_tier = "Good"
+        elif overall_quality > 0.55 and mistake_ratio < 0.35 and total_mistakes < 26:
+            final = spread_score + 5.0
+            quality_tier = "Average"
         else:
-            base_accuracy = 0.0
-        nas, nas_count, avg_pitch_error, correct_pct = note_agreement_score(
-            C_orig_raw, C_user_raw, path, e_orig, e_user, thr_orig, thr_user
+            extra_penalty = mistake_ratio * 15.0 * POOR_PENALTY_MULTIPLIER
+            final = spread_score - extra_penalty - 5.0
+            quality_tier = "Needs Practice"
+    sung_frames = np.sum(e_user > thr_user)
+    total_frames_user = len(e_user)
+    user_sing_ratio = sung_frames / max(1, total_frames_user)
+    if user_sing_ratio < 0.3:
+        final *= 0.4
+        quality_tier = "Too Little Singing"
+    elif user_sing_ratio < 0.5:
+        final *= 0.7
+        quality_tier = "Low Singing Activity"
+    elif user_sing_ratio < 0.7:
+        final *= 0.9
+    user_duration_sec = len(e_user) * HOP / SR
+    if user_duration_sec < MIN_RECORDING_SEC:
+        return _too_short_payload()
+    if vocal_quality < 0.3 or user_sing_ratio < 0.2:
+        metrics.rejected("low_coverage")
+        final = 0.0
+        quality_tier = "No Singing Detected"
+        return {
+            "success": True,
+            "data": {
+                "mistakes": [],
+                "finalScore": 0.0,
+                "qualityTier": quality_tier,
+                "message": "No clear singing detected in your recording."
+            }
+        }
+    final = float(np.clip(final, 0.0, 100.0))
+    mistake_summary = {}
+    for m in mistakes:
+        reason = m['reason']
+        if reason not in mistake_summary:
+            mistake_summary[reason] = {
+                "count": 0,
+                "total_duration": 0.0,
+                "description": m.get('description', '')
+            }
+        mistake_summary[reason]["count"] += 1
+        mistake_summary[reason]["total_duration"] += m['duration']
+    metrics.debug("Scoring | vocal_quality=%.3f | mistakes=%d %s | dtw_acc=%.2f nas=%.2f base=%.2f"
+                  " | mistake_penalty=%.2f | final=%.2f (%s) | duration=%.2fs coverage=%.2f",
+                  vocal_quality, total_mistakes, mistake_summary, accuracy, nas_score,
+                  base_accuracy, mistake_penalty, final, quality_tier,
+                  user_duration_sec, user_sing_ratio)
+    return {
+        "success": True,
+        "data": {
+            "mistakes": mistakes,
+            "mistakeSummary": mistake_summary,
+            "finalScore": round(final, 2),
+            "qualityTier": quality_tier,
+            "message": "Comparison completed successfully",
+            "alignMode": "online" if streamed else (align_mode or ALIGN_MODE),
+        }
+    }
+
+class _GrowingFrames:
+    def __init__(self, rows=None, dtype=np.float32):
+        self.rows = rows
+        self.size = 0
+        shape = (rows, 256) if rows else (256,)
+        self._data = np.zeros(shape, dtype=dtype)
+
+    def append(self, block):
+        k = block.shape[-1]
+        if self.size + k > self._data.shape[-1]:
+            cap = max(self.size + k, 2 * self._data.shape[-1])
+            grown = np.zeros(self._data.shape[:-1] + (cap,), dtype=self._data.dtype)
+            grown[..., :self.size] = self._data[..., :self.size]
+            self._data = grown
+        self._data[..., self.size:self.size + k] = block
+        self.size += k
+
+    def view(self, stop=None):
+        return self._data[..., :self.size if stop is None else stop]
+
+class StreamingSession:
+    def __init__(self, ref, sample_rate):
+        self.ref = ref
+        self.extractor = StreamingFrameExtractor(SR, N_FFT, HOP)
+        self.resampler = None
+        if sample_rate != SR:
+            import soxr
+            self.resampler = soxr.ResampleStream(sample_rate, SR, 1, dtype="float32")
+        self.aligner = OnlineAligner(
+            ref["chroma_unit"], ALPHA,
+            back_frames=STREAM_BACK_SEC * SR / HOP,
+            ahead_frames=STREAM_AHEAD_SEC * SR / HOP,
         )
-        nas_score = 100.0 * nas
-        timing_penalty = compute_timing_penalty(path, sr1, hop_length=HOP)
-        key_penalty = abs(shift) * KEY_SHIFT_PENALTY_PER_STEP
-        r = energy_correlation_along_path(e_orig, e_user, path)
-        energy_corr_penalty = (1.0 - max(0.0, r)) * 3.5
-        mistake_penalty = total_mistakes * MISTAKE_PENALTY_WEIGHT
-        if total_mistakes > 0:
-            mistake_penalty *= 1.2
-        if total_mistakes > 10:
-            mistake_penalty *= 1.4
-        if total_mistakes > 20:
-            mistake_penalty *= 1.5
-        mistake_ratio = mistake_frames / max(1, voiced_frames) if voiced_frames > 0 else 0.0
-        base_score = (W_ACC * accuracy + W_NAS * nas_score + W_BASE * base_accuracy)
-        penalized_score = base_score - timing_penalty - key_penalty - energy_corr_penalty - mistake_penalty
-        is_self_match = (eff_nd < 0.08 and mistake_ratio < 0.02 and accuracy > 98 and total_mistakes == 0)
-        if is_self_match:
-            final = 99.0 + min(1.0, (100.0 - penalized_score) / 10.0)
-            quality_tier = "Perfect Match"
-        else:
-            pitch_quality = max(0.0, 1.0 - (avg_pitch_error / 5.0))
-            note_quality = correct_pct
-            overall_quality = (0.5 * pitch_quality + 0.5 * note_quality)
-            overall_quality *= vocal_quality
-            centered = penalized_score - 50.0
-            spread_score = 50.0 + (centered * SCORE_SPREAD_FACTOR)
-            logging.debug(f"Spread Score: {spread_score}, Centered: {centered}")
-            if overall_quality > 0.75 and mistake_ratio < 0.20 and total_mistakes < 15:
-                final = spread_score + 10.0
-                quality_tier = "Good"
-            elif overall_quality > 0.55 and mistake_ratio < 0.35 and total_mistakes < 26:
-                final = spread_score + 5.0
-                quality_tier = "Average"
-            else:
-                extra_penalty = mistake_ratio * 15.0 * POOR_PENALTY_MULTIPLIER
-                final = spread_score - extra_penalty - 5.0
-                quality_tier = "Needs Practice"
-        sung_frames = np.sum(e_user > thr_user)
-        total_frames_user = len(e_user)
-        user_sing_ratio = sung_frames / max(1, total_frames_user)
-        if user_sing_ratio < 0.3:
-            final *= 0.4
-            quality_tier = "Too Little Singing"
-        elif user_sing_ratio < 0.5:
-            final *= 0.7
-            quality_tier = "Low Singing Activity"
-        elif user_sing_ratio < 0.7:
-            final *= 0.9
-        user_duration_sec = len(e_user) * HOP / SR
-        if user_duration_sec < 30:
-            final = 0.0
-            quality_tier = "Recording Too Short, Need at least 45 seconds."
-            return JSONResponse({
-                "success": True,
-                "data": {
-                    "mistakes": [],
-                    "finalScore": 0.0,
-                    "qualityTier": quality_tier,
-                    "message": "No clear singing detected in your recording."
-                }
-            })
-        if vocal_quality < 0.3 or user_sing_ratio < 0.2:
-            final = 0.0
-            quality_tier = "No Singing Detected"
-            return JSONResponse({
+        self.key_o = int(np.argmax(np.sum(ref["chroma_unit"], axis=1)))
+        self.shift = None
+        self.started = False
+        self.chroma = _GrowingFrames(12)
+        self.unit = _GrowingFrames(12)
+        self.rms = _GrowingFrames()
+        self.flat = _GrowingFrames()
+        self.reported = set()
+        self._last_mistake_scan = 0
+
+    def _append(self, chroma, rms, flat):
+        if not self.started:
+            onset = np.flatnonzero(rms > STREAM_ONSET_RMS)
+            if len(onset) == 0:
+                return
+            self.started = True
+            chroma, rms, flat = chroma[:, onset[0]:], rms[onset[0]:], flat[onset[0]:]
+        self.chroma.append(chroma)
+        self.unit.append(_normalize_chroma_cols(chroma))
+        self.rms.append(rms)
+        self.flat.append(flat)
+
+    def _align(self, force_key=False):
+        if self.shift is None:
+            if self.unit.size < STREAM_KEY_SEC * SR / HOP and not force_key:
+                return
+            key_u = int(np.argmax(np.sum(self.unit.view(), axis=1)))
+            self.shift = key_u - self.key_o
+        pending = self.unit.view()[:, self.aligner.frames:]
+        if pending.shape[1]:
+            self.aligner.extend(np.roll(pending, -self.shift, axis=0))
+
+    def _new_mistakes(self, final=False):
+        done = self.aligner.frames
+        if not done or (not final and done - self._last_mistake_scan < STREAM_MISTAKE_INTERVAL_SEC * SR / HOP):
+            return []
+        self._last_mistake_scan = done
+        user_unit = np.roll(self.unit.view(done), -self.shift, axis=0)
+        t_now = (done - 1) * HOP / SR
+        fresh = []
+        for m in detect_mistake_points(self.ref["chroma_unit"], user_unit, self.aligner.path_arrays(),
+                                       SR, orig_notes=self.ref["notes"]):
+            key = (m["start_time"], m["reason"])
+            if key in self.reported or (not final and m["end_time"] + MIN_GAP >= t_now):
+                continue
+            self.reported.add(key)
+            fresh.append(format_mistake(m))
+        return fresh
+
+    def _progress(self, mistakes):
+        nd = self.aligner.normalized_distance
+        accuracy = 100.0 * np.exp(-K_DECAY * max(0.0, nd - self.ref.meta["nd_self"]))
+        return {
+            "event": "progress",
+            "time": round(self.aligner.frames * HOP / SR, 2),
+            "referenceTime": round(self.aligner.position * HOP / SR, 2),
+            "accuracy": round(float(np.clip(accuracy, 0.0, 100.0)), 2),
+            "mistakes": mistakes,
+        }
+
+    def feed(self, samples):
+        samples = np.asarray(samples, dtype=np.float32)
+        if self.resampler is not None:
+            samples = self.resampler.resample_chunk(samples)
+        self._append(*self.extractor.push(samples))
+        self._align()
+        if self.shift is None:
+            return None
+        return self._progress(self._new_mistakes())
+
+    def finish(self):
+        tail = np.zeros(0, dtype=np.float32)
+        if self.resampler is not None:
+            tail = self.resampler.resample_chunk(tail, last=True)
+        self._append(*self.extractor.push(tail, last=True))
+        if not self.started or self.chroma.size == 0:
+            return {
                 "success": True,
                 "data": {
                     "mistakes": [],
                     "finalScore": 0.0,
-                    "qualityTier": quality_tier,
-                    "message": "No clear singing detected in your recording."
-                }
-            })
-        final = float(np.clip(final, 0.0, 100.0))
-        mistake_summary = {}
-        for m in mistakes:
-            reason = m['reason']
-            if reason not in mistake_summary:
-                mistake_summary[reason] = {
-                    "count": 0,
-                    "total_duration": 0.0,
-                    "description": m.get('description', '')
+                    "qualityTier": "No Singing Detected",
+                    "message": "No voiced singing detected in your recording."
                 }
-            mistake_summary[reason]["count"] += 1
-            mistake_summary[reason]["total_duration"] += m['duration']
-        logging.info(f"=== SCORING DEBUG ===")
-        logging.info(f"Vocal Quality: {vocal_quality:.3f}")
-        logging.info(f"Total Mistakes: {total_mistakes}")
-        logging.info(f"Mistake Summary: {mistake_summary}")
-        logging.info(f"DTW Acc: {accuracy:.2f}, NAS: {nas_score:.2f}, Base: {base_accuracy:.2f}")
-        logging.info(f"Mistake Penalty: {mistake_penalty:.2f}")
-        logging.info(f"Final Score: {final:.2f} | Quality: {quality_tier}")
-        logging.info(f"User duration: {user_duration_sec:.2f}s | Singing coverage: {user_sing_ratio:.2f}")
-        logging.info(f"=====================")
-        return JSONResponse({
-            "success": True,
-            "data": {
-                "mistakes": mistakes,
-                "mistakeSummary": mistake_summary,
-                "finalScore": round(final, 2),
-                "qualityTier": quality_tier,
-                "message": "Comparison completed successfully",
             }
-        })
-    except Exception as e:
-        logging.error(f"Error in compare: {str(e)}", exc_info=True)
-        return JSONResponse(status_code=400, content={
+        self._align(force_key=True)
+        chroma = self.chroma.view()
+        return score_user_features(
+            self.ref, chroma, self.unit.view(),
+            np.sum(chroma, axis=0).astype(np.float32), self.rms.view(), self.flat.view(),
+            key_shift=self.shift, path=self.aligner.path_arrays(),
+        )
+
+def score_job(original_path, user_path, request_id=None, sampled=False, align_mode=None):
+    metrics.bind_request(request_id, sampled)
+    with metrics.collect() as events:
+        try:
+            return 200, score_recording(original_path, user_path, align_mode), events
+        except Exception as e:
+            logging.error(f"[{metrics.request_id()}] Error in compare: {str(e)}", exc_info=True)
+            return 400, {
+                "success": False,
+                "message": str(e)
+            }, events
+
+def warm_reference(original_path):
+    reference_store.get(original_path, compute_reference_features)
+
+def warm_up_reference():
+    return build_reference_features(extract_chroma_from_wave(warmup.synthetic_voice(SR), SR))
+
+def warm_up_scoring():
+    ref = warm_up_reference()
+    y_user = warmup.synthetic_voice(SR, transpose=2)
+    _level_gate(*coarse_level_stats(y_user))
+    _yin_gate(y_user, SR)
+    _, _, C_user_raw, C_user_unit, e_user, rms_user, flat_user = extract_chroma_from_wave(y_user, SR)
+    score_user_features(ref, C_user_raw, C_user_unit, e_user, rms_user, flat_user)
+
+def warm_up_streaming():
+    session = StreamingSession(warm_up_reference(), SR)
+    for block in np.array_split(warmup.synthetic_voice(SR, transpose=2), 8):
+        session.feed(block)
+    session.finish()
+
+def _init_scoring_worker():
+    logging.basicConfig(level=logging.INFO)
+    warmup.warm_worker(warm_up_scoring)
+
+def _worker_ready():
+    return os.getpid()
+
+class ScoringUnavailable(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+    def response(self):
+        headers = {"Retry-After": str(SCORING_RETRY_AFTER_SEC)} if self.status in (429, 503) else None
+        return JSONResponse(status_code=self.status, headers=headers,
+                            content={"success": False, "message": str(self)})
+
+class ScoringPool:
+    def __init__(self, workers, queue_size, timeout_sec):
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_size)
+        self.timeout_sec = timeout_sec
+        self.in_flight = 0
+        self._executor = None
+        self._restarting = False
+
+    def start(self):
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(SCORING_START_METHOD),
+            initializer=_init_scoring_worker,
+        )
+        pids = {f.result() for f in [self._executor.submit(_worker_ready) for _ in range(self.workers)]}
+        logging.info(f"Scoring pool ready with {len(pids)} worker process(es)")
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _release(self):
+        self.in_flight -= 1
+        metrics.queue_depth("scoring", self.in_flight)
+
+    async def _recover(self):
+        if not self._restarting:
+            self._restarting = True
+            try:
+                self.stop()
+                await asyncio.get_running_loop().run_in_executor(None, self.start)
+            finally:
+                self._restarting = False
+
+    async def submit(self, fn, *args):
+        # Admits fn against the shared capacity and waits for its result; raises ScoringUnavailable otherwise.
+        if self._executor is None and not self._restarting:
+            raise ScoringUnavailable(503, "Scoring service is starting up, retry later")
+        if self.in_flight >= self.capacity or self._restarting:
+            raise ScoringUnavailable(429, "Scoring service is busy, retry later")
+        loop = asyncio.get_running_loop()
+        try:
+            fut = self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            await self._recover()
+            raise ScoringUnavailable(503, "Scoring worker crashed, retry later")
+        self.in_flight += 1
+        metrics.queue_depth("scoring", self.in_flight)
+
+        def _done(_):
+            try:
+                loop.call_soon_threadsafe(self._release)
+            except RuntimeError:
+                pass
+        fut.add_done_callback(_done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), self.timeout_sec)
+        except asyncio.TimeoutError:
+            logging.warning(f"Scoring timed out after {self.timeout_sec:.0f}s")
+            raise ScoringUnavailable(504, f"Scoring timed out after {self.timeout_sec:.0f}s")
+        except BrokenProcessPool as e:
+            logging.error(f"Scoring worker crashed: {e}")
+            await self._recover()
+            raise ScoringUnavailable(503, "Scoring worker crashed, retry later")
+
+    async def run(self, fn, *args):
+        try:
+            status, content, events = await self.submit(fn, *args)
+        except ScoringUnavailable as e:
+            return e.response()
+        metrics.replay(events)
+        return JSONResponse(status_code=status, content=content)
+
+scoring_pool = ScoringPool(SCORING_WORKERS, SCORING_QUEUE_SIZE, SCORING_TIMEOUT_SEC)
+readiness = warmup.Readiness()
+
+def _warming_up():
+    return ScoringUnavailable(503, "Scoring service is starting up, retry later").response()
+
+@asynccontextmanager
+async def lifespan(app):
+    steps = [("scoring_pool", scoring_pool.start)]
+    if warmup.WARMUP:
+        steps.append(("streaming", warm_up_streaming))
+    startup = readiness.start(steps)
+    yield
+    await startup
+    scoring_pool.stop()
+
+app = FastAPI(lifespan=lifespan)
+metrics.install(app, "compare")
+warmup.install(app, readiness)
+
+def _bad_align_mode(align_mode):
+    return JSONResponse(status_code=400, content={
+        "success": False,
+        "message": f"unknown alignMode '{align_mode}', expected one of {list(ALIGN_MODES)}"
+    })
+
+@app.post("/compare")
+async def compare(request: CompareRequest):
+    if request.alignMode is not None and request.alignMode not in ALIGN_MODES:
+        return _bad_align_mode(request.alignMode)
+    return await scoring_pool.run(score_job, request.originalSongPath, request.userSongPath,
+                                  metrics.request_id(), metrics.log_sampled(), request.alignMode)
+
+def _batch_state_path(job_id):
+    if not re.fullmatch(r"[A-Za-z0-9_.-]+", job_id):
+        raise ValueError(f"invalid batch job id '{job_id}'")
+    os.makedirs(BATCH_STATE_DIR, exist_ok=True)
+    return os.path.join(BATCH_STATE_DIR, f"{job_id}.ndjson")
+
+def _load_batch_state(state_path, original_path):
+    done = {}
+    if not os.path.exists(state_path):
+        return done
+    with open(state_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("originalSongPath") == original_path and entry.get("status", 500) < 500:
+                done[entry["userSongPath"]] = entry
+    return done
+
+async def _batch_lines(request, job_id, state_path, request_id=None, sampled=False):
+    paths = list(dict.fromkeys(request.userSongPaths))
+    total = len(paths)
+    done = _load_batch_state(state_path, request.originalSongPath)
+    yield json.dumps({"type": "start", "jobId": job_id, "total": total, "resumed": len(done)}) + "\n"
+    completed = failed = 0
+    for path in paths:
+        if path in done:
+            completed += 1
+            failed += int(done[path]["status"] != 200)
+            yield json.dumps(dict(done[path], type="result", resumed=True,
+                                 completed=completed, total=total)) + "\n"
+    todo = [p for p in paths if p not in done]
+    if todo:
+        try:
+            await scoring_pool.submit(warm_reference, request.originalSongPath)
+        except Exception as e:
+            logging.error(f"[{request_id}] Batch {job_id} could not load the reference: {str(e)}")
+            yield json.dumps({"type": "error", "jobId": job_id,
+                              "status": getattr(e, "status", 400), "message": str(e)}) + "\n"
+            yield json.dumps({"type": "summary", "jobId": job_id, "total": total,
+                              "completed": completed, "failed": failed + len(todo)}) + "\n"
+            return
+    pending = set()
+    retry = []
+    throttled = False
+    queue = iter(todo)
+    with open(state_path, "a") as state:
+        while True:
+            while not throttled and len(pending) < BATCH_CONCURRENCY:
+                path = retry.pop() if retry else next(queue, None)
+                if path is None:
+                    break
+                fut = asyncio.ensure_future(scoring_pool.submit(
+                    score_job, request.originalSongPath, path, request_id, sampled, request.alignMode
+                ))
+                fut.user_path = path
+                pending.add(fut)
+            if not pending:
+                if not throttled:
+                    break
+                await asyncio.sleep(SCORING_RETRY_AFTER_SEC)
+                throttled = False
+                continue
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            throttled = False
+            for fut in finished:
+                try:
+                    status, content, events = fut.result()
+                    metrics.replay(events)
+                except ScoringUnavailable as e:
+                    if e.status == 429:
+                        # Pool is full with other requests: hold this take back until capacity frees up.
+                        retry.append(fut.user_path)
+                        throttled = True
+                        continue
+                    status, content = e.status, {"success": False, "message": str(e)}
+                except Exception as e:
+                    status, content = 500, {"success": False, "message": str(e)}
+                entry = {
+                    "originalSongPath": request.originalSongPath,
+                    "userSongPath": fut.user_path,
+                    "status": status,
+                    "result": content,
+                }
+                state.write(json.dumps(entry) + "\n")
+                state.flush()
+                completed += 1
+                failed += int(status != 200)
+                yield json.dumps(dict(entry, type="result", resumed=False,
+                                      completed=completed, total=total)) + "\n"
+    yield json.dumps({"type": "summary", "jobId": job_id, "total": total,
+                      "completed": completed, "failed": failed}) + "\n"
+
+@app.post("/compare/batch")
+async def compare_batch(request: BatchCompareRequest):
+    job_id = request.jobId or uuid.uuid4().hex
+    if request.alignMode is not None and request.alignMode not in ALIGN_MODES:
+        return _bad_align_mode(request.alignMode)
+    try:
+        state_path = _batch_state_path(job_id)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "message": str(e)})
+    if not os.path.isfile(request.originalSongPath):
+        return JSONResponse(status_code=404, content={
             "success": False,
-            "message": str(e)
+            "message": f"original song not found: {request.originalSongPath}"
         })
+    if scoring_pool._executor is None:
+        return _warming_up()
+    return StreamingResponse(_batch_lines(request, job_id, state_path,
+                                          metrics.request_id(), metrics.log_sampled()),
+                             media_type="application/x-ndjson")
+
+_stream_sessions = 0
+
+def _decode_pcm(data, encoding):
+    if encoding == "s16le":
+        return np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+    return np.frombuffer(data, dtype="<f4")
+
+@app.websocket("/compare/stream")
+async def compare_stream(ws: WebSocket):
+    global _stream_sessions
+    metrics.bind_request(ws.headers.get(metrics.REQUEST_ID_HEADER))
+    await ws.accept()
+    if _stream_sessions >= STREAM_MAX_SESSIONS:
+        await ws.send_json({"event": "error", "message": "Too many live sessions, retry later"})
+        await ws.close(code=1013)
+        return
+    _stream_sessions += 1
+    metrics.queue_depth("stream_sessions", _stream_sessions)
+    loop = asyncio.get_running_loop()
+    try:
+        start = await ws.receive_json()
+        encoding = start.get("encoding", "f32le")
+        if encoding not in ("f32le", "s16le"):
+            raise ValueError(f"unsupported encoding '{encoding}'")
+        ref = await loop.run_in_executor(
+            None, reference_store.get, start["originalSongPath"], compute_reference_features
+        )
+        session = StreamingSession(ref, int(start.get("sampleRate", SR)))
+        await ws.send_json({"event": "ready"})
+        while True:
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect":
+                return
+            if msg.get("bytes") is not None:
+                update = await loop.run_in_executor(
+                    None, session.feed, _decode_pcm(msg["bytes"], encoding)
+                )
+                if update is not None:
+                    await ws.send_json(update)
+            elif msg.get("text") is not None and json.loads(msg["text"]).get("event") == "end":
+                result = await loop.run_in_executor(None, session.finish)
+                await ws.send_json(dict(result, event="final"))
+                await ws.close()
+                return
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logging.error(f"Error in compare stream: {str(e)}", exc_info=True)
+        try:
+            await ws.send_json({"event": "error", "success": False, "message": str(e)})
+            await ws.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        _stream_sessions -= 1
+        metrics.queue_depth("stream_sessions", _stream_sessions)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
@@ -0,0 +1,179 @@
+import numpy as np
+from fastdtw import fastdtw
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+
+ENGINES = ("banded", "fastdtw")
+BANDS = ("sakoe", "slope", "full")
+BLOCK_ROWS = 256
+
+DIAG, UP, LEFT = 0, 1, 2
+
+
+def _fast_hybrid_distance_factory(alpha: float):
+    def dist(x, y):
+        dot = float(np.dot(x, y))
+        cos_d = 1.0 - dot
+        eu_d  = np.sqrt(max(0.0, 2.0 - 2.0 * dot))
+        return alpha * cos_d + (1.0 - alpha) * eu_d
+    return dist
+
+
+def hybrid_cost(dots, alpha):
+    dots = np.asarray(dots, dtype=np.float64)
+    return alpha * (1.0 - dots) + (1.0 - alpha) * np.sqrt(np.maximum(0.0, 2.0 - 2.0 * dots))
+
+
+def path_cost(A_unit, B_unit, alpha, oi, ui):
+    A = np.asarray(A_unit, dtype=np.float32)
+    B = np.asarray(B_unit, dtype=np.float32)
+    dots = np.einsum("ij,ij->j", A[:, oi], B[:, ui])
+    return float(np.sum(hybrid_cost(dots, alpha)))
+
+
+def _fix_window(lo, hi, m):
+    lo = np.clip(np.asarray(lo, dtype=np.int64), 0, m - 1)
+    hi = np.clip(np.asarray(hi, dtype=np.int64), 0, m - 1)
+    lo[0] = 0
+    hi[-1] = m - 1
+    lo = np.maximum.accumulate(lo)
+    hi = np.maximum.accumulate(np.maximum(hi, lo))
+    lo[1:] = np.minimum(lo[1:], hi[:-1] + 1)
+    return lo, hi
+
+
+def full_window(n, m):
+    return np.zeros(n, dtype=np.int64), np.full(n, m - 1, dtype=np.int64)
+
+
+def sakoe_chiba_window(n, m, radius):
+    radius = max(1, int(radius))
+    scale = (m - 1) / max(1, n - 1)
+    center = np.arange(n) * scale
+    reach = radius + int(np.ceil(scale))
+    lo = np.floor(center).astype(np.int64) - reach
+    hi = np.ceil(center).astype(np.int64) + reach
+    return _fix_window(lo, hi, m)
+
+
+def slope_window(n, m, slope):
+    slope = max(1.0 + 1e-6, float(slope))
+    x = np.arange(n) / max(1, n - 1)
+    low = np.maximum(x / slope, 1.0 - slope * (1.0 - x))
+    high = np.minimum(slope * x, 1.0 - (1.0 - x) / slope)
+    lo = np.floor(low * (m - 1)).astype(np.int64) - 1
+    hi = np.ceil(high * (m - 1)).astype(np.int64) + 1
+    return _fix_window(lo, hi, m)
+
+
+def dtw_windowed(A_unit, B_unit, alpha, lo, hi):
+    A = np.ascontiguousarray(A_unit, dtype=np.float32)
+    B = np.ascontiguousarray(B_unit, dtype=np.float32)
+    n, m = A.shape[1], B.shape[1]
+    if n == 0 or m == 0:
+        return 0.0, []
+    lo, hi = _fix_window(lo, hi, m)
+    width = int(np.max(hi - lo + 1))
+    steps = np.full((n, width), LEFT, dtype=np.int8)
+    prev = None
+    prev_lo = prev_hi = 0
+    for i0 in range(0, n, BLOCK_ROWS):
+        i1 = min(n, i0 + BLOCK_ROWS)
+        c0, c1 = int(lo[i0]), int(hi[i1 - 1]) + 1
+        cost_block = hybrid_cost(A[:, i0:i1].T @ B[:, c0:c1], alpha)
+        for i in range(i0, i1):
+            l, h = int(lo[i]), int(hi[i])
+            cost = cost_block[i - i0, l - c0:h - c0 + 1]
+            csum = np.cumsum(cost)
+            if prev is None:
+                row = csum
+                steps[i, :h - l + 1] = LEFT
+            else:
+                up = np.full(h - l + 1, np.inf)
+                a, b = max(l, prev_lo), min(h, prev_hi)
+                if a <= b:
+                    up[a - l:b - l + 1] = prev[a - prev_lo:b - prev_lo + 1]
+                diag = np.full(h - l + 1, np.inf)
+                a, b = max(l, prev_lo + 1), min(h, prev_hi + 1)
+                if a <= b:
+                    diag[a - l:b - l + 1] = prev[a - 1 - prev_lo:b - prev_lo]
+                vertical = np.minimum(diag, up)
+                entry = cost + vertical
+                shifted = entry - csum
+                best = np.minimum.accumulate(shifted)
+                row = best + csum
+                step = np.where(diag <= up, DIAG, UP).astype(np.int8)
+                step[best < shifted] = LEFT
+                steps[i, :h - l + 1] = step
+            prev, prev_lo, prev_hi = row, l, h
+    distance = float(prev[-1])
+    path = []
+    i, j = n - 1, m - 1
+    while True:
+        path.append((i, j))
+        if i == 0 and j == 0:
+            break
+        step = steps[i, j - lo[i]] if i > 0 else LEFT
+        if step == DIAG:
+            i, j = i - 1, j - 1
+        elif step == UP:
+            i -= 1
+        else:
+            j -= 1
+    path.reverse()
+    return distance, path
+
+
+def band_window(n, m, band="sakoe", radius=None, slope=2.0):
+    if band == "full" or (band == "sakoe" and radius is None):
+        return full_window(n, m)
+    if band == "sakoe":
+        return sakoe_chiba_window(n, m, radius)
+    if band == "slope":
+        return slope_window(n, m, slope)
+    raise ValueError(f"unknown DTW band '{band}', expected one of {BANDS}")
+
+
+def align(A_unit, B_unit, alpha, engine="banded", band="sakoe", radius=None, slope=2.0):
+    if engine == "fastdtw":
+        return fastdtw(A_unit.T, B_unit.T, dist=_fast_hybrid_distance_factory(alpha))
+    if engine != "banded":
+        raise ValueError(f"unknown DTW engine '{engine}', expected one of {ENGINES}")
+    lo, hi = band_window(A_unit.shape[1], B_unit.shape[1], band, radius, slope)
+    return dtw_windowed(A_unit, B_unit, alpha, lo, hi)
+
+
+def fixed_segments(n, size):
+    size = max(1, int(size))
+    return np.append(np.arange(0, n, size, dtype=np.int64), n)
+
+
+def segment_means(X_unit, bounds):
+    X = np.asarray(X_unit, dtype=np.float32)
+    sums = np.add.reduceat(X, bounds[:-1], axis=1)
+    means = sums / np.diff(bounds).astype(np.float32)
+    return means / (np.linalg.norm(means, axis=0, keepdims=True) + 1e-8)
+
+
+def corridor_window(coarse_path, a_bounds, b_bounds, radius):
+    n, m = int(a_bounds[-1]), int(b_bounds[-1])
+    p, q = (np.asarray(x, dtype=np.int64) for x in zip(*coarse_path))
+    seg_lo = np.full(len(a_bounds) - 1, m, dtype=np.int64)
+    seg_hi = np.full(len(a_bounds) - 1, -1, dtype=np.int64)
+    np.minimum.at(seg_lo, p, b_bounds[q])
+    np.maximum.at(seg_hi, p, b_bounds[q + 1] - 1)
+    rows = np.repeat(np.arange(len(a_bounds) - 1), np.diff(a_bounds))
+    size = 2 * int(radius) + 1
+    lo = minimum_filter1d(seg_lo[rows], size, mode="nearest") - radius
+    hi = maximum_filter1d(seg_hi[rows], size, mode="nearest") + radius
+    return _fix_window(lo, hi, m)
+
+
+def align_coarse_to_fine(A_unit, B_unit, alpha, a_bounds, b_bounds, radius,
+                         band="sakoe", coarse_radius=None, slope=2.0):
+    A_seg = segment_means(A_unit, a_bounds)
+    B_seg = segment_means(B_unit, b_bounds)
+    lo, hi = band_window(A_seg.shape[1], B_seg.shape[1], band, coarse_radius, slope)
+    _, coarse_path = dtw_windowed(A_seg, B_seg, alpha, lo, hi)
+    lo, hi = corridor_window(coarse_path, a_bounds, b_bounds, radius)
+    return dtw_windowed(A_unit, B_unit, alpha, lo, hi)
+
@@ -0,0 +1,185 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+META_FILE = "meta.json"
+
+
+class FeatureSet:
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    @property
+    def nbytes(self):
+        return int(sum(a.nbytes for a in self.arrays.values()))
+
+
+def save_feature_dir(target_dir, features):
+    parent = os.path.dirname(os.path.abspath(target_dir))
+    os.makedirs(parent, exist_ok=True)
+    # Not mkdtemp: its 0700 mode would survive the rename; 0o755 lets the umask decide as usual.
+    tmp_dir = os.path.join(parent, f".tmp-{uuid.uuid4().hex}")
+    os.mkdir(tmp_dir, 0o755)
+    try:
+        for name, arr in features.arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(arr))
+        meta = dict(features.meta, arrays=sorted(features.arrays))
+        with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+            json.dump(meta, f)
+        if os.path.isdir(target_dir):
+            shutil.rmtree(target_dir, ignore_errors=True)
+        os.replace(tmp_dir, target_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def load_feature_dir(target_dir, mmap=True):
+    meta_path = os.path.join(target_dir, META_FILE)
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    arrays = {}
+    for name in meta.pop("arrays", []):
+        arrays[name] = np.load(os.path.join(target_dir, f"{name}.npy"),
+                               mmap_mode="r" if mmap else None)
+    return FeatureSet(arrays, meta)
+
+
+def source_stamp(path):
+    st = os.stat(path)
+    return os.path.abspath(path), int(st.st_mtime_ns), int(st.st_size)
+
+
+class ReferenceFeatureStore:
+    def __init__(self, cache_dir, config_version, max_bytes, sidecar_suffix=None):
+        self.cache_dir = cache_dir
+        self.config_version = config_version
+        self.max_bytes = max_bytes
+        self.sidecar_suffix = sidecar_suffix
+        self._mem = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key(self, path):
+        abspath, mtime_ns, size = source_stamp(path)
+        raw = f"{abspath}|{mtime_ns}|{size}|{self.config_version}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest(), abspath, mtime_ns, size
+
+    def _stamp(self, abspath, mtime_ns, size):
+        return {
+            "source_path": abspath,
+            "source_mtime_ns": mtime_ns,
+            "source_size": size,
+            "config_version": self.config_version,
+        }
+
+    def sidecar_dir(self, path):
+        return f"{path}{self.sidecar_suffix}"
+
+    def _load_sidecar(self, path, mtime_ns, size):
+        if not self.sidecar_suffix:
+            return None
+        sidecar = self.sidecar_dir(path)
+        try:
+            features = load_feature_dir(sidecar)
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable feature sidecar {sidecar}: {e}")
+            return None
+        if features is None:
+            return None
+        meta = features.meta
+        if (meta.get("config_version") != self.config_version
+                or meta.get("source_mtime_ns") != mtime_ns
+                or meta.get("source_size") != size):
+            return None
+        return features
+
+    def sidecar_current(self, path):
+        _, mtime_ns, size = source_stamp(path)
+        return self._load_sidecar(path, mtime_ns, size) is not None
+
+    def write_sidecar(self, path, compute):
+        abspath, mtime_ns, size = source_stamp(path)
+        features = compute(path)
+        features.meta.update(self._stamp(abspath, mtime_ns, size))
+        save_feature_dir(self.sidecar_dir(path), features)
+        return features
+
+    def _mem_get(self, key):
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                self._mem.move_to_end(key)
+            return hit
+
+    def _mem_put(self, key, features):
+        size = features.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_bytes -= old.nbytes
+            self._mem[key] = features
+            self._mem_bytes += size
+            while self._mem_bytes > self.max_bytes and self._mem:
+                _, evicted = self._mem.popitem(last=False)
+                self._mem_bytes -= evicted.nbytes
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def get(self, path, compute):
+        key, abspath, mtime_ns, size = self._key(path)
+        hit = self._mem_get(key)
+        if hit is not None:
+            return hit
+        try:
+            with self._key_lock(key):
+                hit = self._mem_get(key)
+                if hit is not None:
+                    return hit
+                disk_dir = os.path.join(self.cache_dir, key)
+                features = self._load_sidecar(path, mtime_ns, size)
+                if features is None:
+                    try:
+                        features = load_feature_dir(disk_dir)
+                    except Exception as e:
+                        logging.warning(f"Discarding unreadable feature cache {disk_dir}: {e}")
+                        shutil.rmtree(disk_dir, ignore_errors=True)
+                if features is None:
+                    features = compute(path)
+                    features.meta.update(self._stamp(abspath, mtime_ns, size))
+                    try:
+                        save_feature_dir(disk_dir, features)
+                        features = load_feature_dir(disk_dir)
+                    except OSError as e:
+                        logging.warning(f"Could not persist feature cache {disk_dir}: {e}")
+                self._mem_put(key, features)
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+        return features
+
+    def clear_memory(self):
+        with self._lock:
+            self._mem.clear()
+            self._mem_bytes = 0
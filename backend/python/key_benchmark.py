@@ -0,0 +1,121 @@
+import os
+import sys
+import argparse
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+from benchmark import machine_info, measure
+from key_detection import FAST_KEY_WINDOW_SEC, FAST_KEY_WINDOWS, NOTE_NAMES, SAMPLE_RATE, detect_key_path
+
+FIXTURE_SR = 22050
+FIXTURE_SEC = 300
+CHORD_SEC = 2.0
+MIN_AGREEMENT = 0.9
+PROGRESSIONS = {
+    "major": ((0, 4, 7), (5, 9, 0), (7, 11, 2), (9, 0, 4)),
+    "minor": ((0, 3, 7), (5, 8, 0), (7, 10, 2), (3, 7, 10)),
+}
+SCALES = {
+    "major": (0, 2, 4, 5, 7, 9, 11),
+    "minor": (0, 2, 3, 5, 7, 8, 10),
+}
+KEYS = [(tonic, mode) for mode in ("major", "minor") for tonic in range(12)]
+
+
+def _tone(midi, n, sr, amp):
+    t = np.arange(n) / sr
+    f0 = 440.0 * 2 ** ((midi - 69) / 12)
+    env = np.minimum(1.0, np.minimum(t / 0.02, (n / sr - t) / 0.1))
+    return amp * env * sum(np.sin(2 * np.pi * k * f0 * t) / k ** 1.5 for k in range(1, 5))
+
+
+def synth_key_fixture(tonic, mode, seconds, sr=FIXTURE_SR, seed=0):
+    rng = np.random.default_rng(seed * 100 + tonic * 2 + (mode == "minor"))
+    n_chord = int(CHORD_SEC * sr)
+    progression, scale = PROGRESSIONS[mode], SCALES[mode]
+    out = []
+    for bar in range(int(np.ceil(seconds / CHORD_SEC))):
+        chord = progression[0] if bar % 2 == 0 else progression[rng.integers(1, len(progression))]
+        y = _tone(36 + tonic, n_chord, sr, 0.12)
+        y += sum(_tone(48 + tonic + iv, n_chord, sr, 0.06) for iv in chord)
+        for j in range(4):
+            note = 60 + tonic + scale[rng.integers(len(scale))]
+            seg = _tone(note, n_chord // 4, sr, 0.08)
+            y[j * (n_chord // 4):(j + 1) * (n_chord // 4)] += seg
+        out.append(y)
+    y = np.concatenate(out)[:int(seconds * sr)]
+    y += 0.01 * rng.standard_normal(len(y))
+    return y.astype(np.float32)
+
+
+def key_label(tonic, mode):
+    return f"{NOTE_NAMES[tonic]} {mode}"
+
+
+def write_key_fixtures(target_dir, keys, seconds):
+    os.makedirs(target_dir, exist_ok=True)
+    paths = {}
+    for tonic, mode in keys:
+        path = os.path.join(target_dir, f"{seconds}s-{NOTE_NAMES[tonic].replace('#', 's')}-{mode}.flac")
+        if not os.path.isfile(path):
+            sf.write(path, synth_key_fixture(tonic, mode, seconds), FIXTURE_SR)
+        paths[path] = key_label(tonic, mode)
+    return paths
+
+
+def run_agreement(paths, repeat=1):
+    rows = []
+    for path, expected in paths.items():
+        full_key, full = measure(detect_key_path, path, SAMPLE_RATE, "full", repeat=repeat)
+        fast_key, fast = measure(detect_key_path, path, SAMPLE_RATE, "fast", repeat=repeat)
+        rows.append({
+            "path": path,
+            "expected": expected,
+            "full_key": full_key,
+            "fast_key": fast_key,
+            "full": full,
+            "fast": fast,
+        })
+    return rows
+
+
+def summarize(rows):
+    lines = [f"{'track':<40}{'expected':>10}{'full':>10}{'fast':>10}{'full_s':>9}{'fast_s':>9}{'fast_mb':>9}"]
+    for r in rows:
+        lines.append(f"{os.path.basename(r['path'])[:39]:<40}{r['expected'] or '-':>10}{r['full_key']:>10}"
+                     f"{r['fast_key']:>10}{r['full']['wall_s']:>9.3f}{r['fast']['wall_s']:>9.3f}"
+                     f"{r['fast']['peak_mb']:>9.1f}"
+                     f"{'' if r['full_key'] == r['fast_key'] else '  DISAGREE'}")
+    agreement = float(np.mean([r["full_key"] == r["fast_key"] for r in rows]))
+    speedup = float(np.median([r["full"]["wall_s"] / max(r["fast"]["wall_s"], 1e-9) for r in rows]))
+    fast_p95 = float(np.percentile([r["fast"]["wall_s"] for r in rows], 95))
+    lines.append(f"agreement {100 * agreement:.1f}% over {len(rows)} track(s), median speedup {speedup:.1f}x, "
+                 f"fast p95 {fast_p95:.3f}s ({FAST_KEY_WINDOWS} x {FAST_KEY_WINDOW_SEC:g}s windows max)")
+    return agreement, "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Agreement and latency of fast windowed key detection against the full-track result")
+    parser.add_argument("--seconds", type=int, default=FIXTURE_SEC, help="length of the synthetic key fixtures")
+    parser.add_argument("--keys", type=int, default=8, help=f"number of synthetic fixtures, spread over the {len(KEYS)} keys (0 for none)")
+    parser.add_argument("--files", nargs="*", default=[], help="extra audio files to compare, e.g. real song masters")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per mode after the traced warm-up run, best is kept")
+    parser.add_argument("--min-agreement", type=float, default=MIN_AGREEMENT)
+    parser.add_argument("--fixture-dir", default=None)
+    args = parser.parse_args(argv)
+    fixture_dir = args.fixture_dir or os.path.join(tempfile.gettempdir(), "singo-key-fixtures")
+    keys = [KEYS[i] for i in np.linspace(0, len(KEYS) - 1, args.keys).round().astype(int)] if args.keys else []
+    paths = write_key_fixtures(fixture_dir, keys, args.seconds)
+    paths.update({path: None for path in args.files})
+    if not paths:
+        parser.error("nothing to benchmark, pass --keys or --files")
+    agreement, table = summarize(run_agreement(paths, args.repeat))
+    print(table)
+    print(f"machine {machine_info()}")
+    return 0 if agreement >= args.min_agreement else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+from typing import Optional
+import os
+import json
+import hashlib
+import numpy as np
+import librosa
+import soundfile as sf
+import metrics
+import audio_cache
+from audio_cache import file_sha256
+import warmup
+
+NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G',
+              'G#', 'A', 'A#', 'B']
+SAMPLE_RATE = 44100
+KEY_EXTRACTION_MODE = os.environ.get("KEY_EXTRACTION_MODE", "auto")
+KEY_BLOCKWISE_MIN_SEC = float(os.environ.get("KEY_BLOCKWISE_MIN_SEC", "300"))
+KEY_BLOCK_SEC = 30.0
+KEY_DETECTION_MODES = ("full", "fast")
+KEY_DETECTION_MODE = os.environ.get("KEY_DETECTION_MODE", "full")
+FAST_KEY_SR = 11025
+FAST_KEY_WINDOWS = int(os.environ.get("FAST_KEY_WINDOWS", "12"))
+FAST_KEY_WINDOW_SEC = float(os.environ.get("FAST_KEY_WINDOW_SEC", "6.0"))
+FAST_KEY_MIN_WINDOWS = 4
+FAST_KEY_MIN_MARGIN = float(os.environ.get("FAST_KEY_MIN_MARGIN", "0.05"))
+KEY_ANALYSIS_VERSION = 1
+KEY_CACHE_DIR = os.environ.get("KEY_CACHE_DIR", "key_cache")
+
+def blockwise_chroma_sum(path: str, sr: int, block_sec: float = KEY_BLOCK_SEC):
+    from spectral_features import pcm_blocks
+    chroma_sum = np.zeros(12)
+    pending, pending_len = [], 0
+    block_len = int(block_sec * sr)
+    for y in pcm_blocks(path, sr):
+        pending.append(y)
+        pending_len += len(y)
+        if pending_len >= block_len:
+            chroma_sum += np.sum(librosa.feature.chroma_cqt(y=np.concatenate(pending), sr=sr), axis=1)
+            pending, pending_len = [], 0
+    if pending_len:
+        chroma_sum += np.sum(librosa.feature.chroma_cqt(y=np.concatenate(pending), sr=sr), axis=1)
+    return chroma_sum
+
+def use_blockwise(path: str):
+    if KEY_EXTRACTION_MODE != "auto":
+        return KEY_EXTRACTION_MODE == "blockwise"
+    try:
+        return sf.info(path).duration >= KEY_BLOCKWISE_MIN_SEC
+    except Exception:
+        return False
+
+def key_from_chroma(chroma_sum: np.ndarray):
+    if not np.any(chroma_sum):
+        raise ValueError("No audio data found.")
+    tonic_index = np.argmax(chroma_sum)
+    tonic_note = NOTE_NAMES[tonic_index]
+    major_intervals = [0, 4, 7]
+    minor_intervals = [0, 3, 7]
+    major_score = sum(chroma_sum[(tonic_index + i) % 12] for i in major_intervals)
+    minor_score = sum(chroma_sum[(tonic_index + i) % 12] for i in minor_intervals)
+    mode = "major" if major_score >= minor_score else "minor"
+    return f"{tonic_note} {mode}"
+
+def key_margin(chroma_sum: np.ndarray):
+    # Relative gap behind both decisions: tonic vs runner-up bin, major vs minor third.
+    top = np.sort(chroma_sum)[::-1]
+    tonic_index = int(np.argmax(chroma_sum))
+    tonic_gap = (top[0] - top[1]) / top[0]
+    mode_gap = abs(chroma_sum[(tonic_index + 4) % 12] - chroma_sum[(tonic_index + 3) % 12]) / top[0]
+    return float(min(tonic_gap, mode_gap))
+
+def detect_key_librosa(audio_data: Optional[np.ndarray], sr: int, path: Optional[str] = None):
+    if audio_data is None:
+        chroma_sum = blockwise_chroma_sum(path, sr)
+    else:
+        chroma = librosa.feature.chroma_cqt(y=audio_data, sr=sr)
+        chroma_sum = np.sum(chroma, axis=1)
+    return key_from_chroma(chroma_sum)
+
+def window_offsets(duration: float, windows: int = FAST_KEY_WINDOWS, window_sec: float = FAST_KEY_WINDOW_SEC):
+    # Van der Corput order: every prefix of the visit order is spread across the whole track.
+    span = max(0.0, duration - window_sec)
+    offsets = []
+    for i in range(1, windows + 1):
+        frac, denom = 0.0, 1.0
+        while i:
+            denom *= 2
+            frac += (i & 1) / denom
+            i >>= 1
+        offsets.append(frac * span)
+    return offsets
+
+@metrics.timed("key_detection")
+def detect_key_fast(path: str, duration: float, sr: int = FAST_KEY_SR,
+                    windows: int = FAST_KEY_WINDOWS, window_sec: float = FAST_KEY_WINDOW_SEC):
+    if duration <= window_sec * FAST_KEY_MIN_WINDOWS:
+        return None
+    window_sums = []
+    for offset in window_offsets(duration, windows, window_sec):
+        y, _ = librosa.load(path, sr=sr, mono=True, offset=offset, duration=window_sec)
+        if len(y):
+            window_sums.append(np.sum(librosa.feature.chroma_cqt(y=y, sr=sr), axis=1))
+        if len(window_sums) < FAST_KEY_MIN_WINDOWS:
+            continue
+        chroma_sum = np.sum(window_sums, axis=0)
+        if not np.any(chroma_sum) or key_margin(chroma_sum) < FAST_KEY_MIN_MARGIN:
+            continue
+        key = key_from_chroma(chroma_sum)
+        # Stable means no single window decides the estimate.
+        if all(np.any(chroma_sum - w) and key_from_chroma(chroma_sum - w) == key for w in window_sums):
+            metrics.debug("Fast key %s stable after %d window(s)", key, len(window_sums))
+            return key
+    metrics.debug("Fast key not stable after %d window(s), using the full track", len(window_sums))
+    return None
+
+def detect_key_path(path: str, sr: int = SAMPLE_RATE, mode: Optional[str] = None,
+                    content_hash: Optional[str] = None):
+    mode = mode or KEY_DETECTION_MODE
+    if mode not in KEY_DETECTION_MODES:
+        raise ValueError(f"unknown key detection mode '{mode}', expected one of {list(KEY_DETECTION_MODES)}")
+    if mode == "fast":
+        try:
+            duration = sf.info(path).duration
+        except Exception:
+            duration = None
+        key = detect_key_fast(path, duration) if duration else None
+        if key is not None:
+            return key
+    # A full-track pass after an unstable fast estimate gets its own stage, so key_detection counts each request once.
+    stage = "key_detection_fallback" if mode == "fast" else "key_detection"
+    if use_blockwise(path):
+        with metrics.stage(stage):
+            return detect_key_librosa(None, sr, path=path)
+    with metrics.stage("decode"):
+        audio_data, sr = audio_cache.load(path, sr=sr, mono=True, content_hash=content_hash)
+    if len(audio_data) == 0:
+        metrics.rejected("empty_audio")
+        raise ValueError("No audio data found.")
+    with metrics.stage(stage):
+        return detect_key_librosa(audio_data, sr)
+
+def key_params_hash(mode: Optional[str] = None, sr: int = SAMPLE_RATE):
+    mode = mode or KEY_DETECTION_MODE
+    params = {
+        "version": KEY_ANALYSIS_VERSION,
+        "mode": mode,
+        "sr": sr,
+        "extraction": [KEY_EXTRACTION_MODE, KEY_BLOCKWISE_MIN_SEC, KEY_BLOCK_SEC],
+    }
+    if mode == "fast":
+        params["fast"] = [FAST_KEY_SR, FAST_KEY_WINDOWS, FAST_KEY_WINDOW_SEC, FAST_KEY_MIN_WINDOWS, FAST_KEY_MIN_MARGIN]
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+class KeyResultCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def _path(self, content_hash: str, params: str):
+        return os.path.join(self.cache_dir, params, f"{content_hash}.json")
+
+    def get(self, content_hash: str, params: str):
+        try:
+            with open(self._path(content_hash, params)) as f:
+                return json.load(f)["detectedKey"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, content_hash: str, params: str, detected_key: str):
+        path = self._path(content_hash, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"detectedKey": detected_key}, f)
+        os.replace(tmp_path, path)
+
+key_cache = KeyResultCache(KEY_CACHE_DIR)
+
+def detect_key_cached(path: str, sr: int = SAMPLE_RATE, mode: Optional[str] = None,
+                      content_hash: Optional[str] = None):
+    content_hash = content_hash or file_sha256(path)
+    params = key_params_hash(mode, sr)
+    detected_key = key_cache.get(content_hash, params)
+    if detected_key is not None:
+        return detected_key, True
+    detected_key = detect_key_path(path, sr, mode=mode, content_hash=content_hash)
+    key_cache.put(content_hash, params, detected_key)
+    return detected_key, False
+
+def warm_up_key_detection():
+    detect_key_librosa(warmup.synthetic_voice(SAMPLE_RATE), SAMPLE_RATE)
+    detect_key_librosa(warmup.synthetic_voice(FAST_KEY_SR), FAST_KEY_SR)
+
+def detect_key_job(path: str, mode: Optional[str] = None, content_hash: Optional[str] = None,
+                   request_id: Optional[str] = None, sampled: bool = False):
+    metrics.bind_request(request_id, sampled)
+    with metrics.collect() as events:
+        try:
+            detected_key, cached = detect_key_cached(path, SAMPLE_RATE, mode, content_hash)
+            return 200, {"success": True, "detectedKey": detected_key, "cached": cached}, events
+        except (OSError, ValueError) as e:
+            return 400, {"success": False, "message": str(e)}, events
+        except Exception as e:
+            return 500, {"success": False, "message": str(e)}, events
@@ -0,0 +1,515 @@
+import os
+import io
+import sys
+import json
+import time
+import socket
+import random
+import argparse
+import importlib
+import itertools
+import tempfile
+import threading
+import subprocess
+import contextlib
+import concurrent.futures
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# The services run inside a scratch workdir; keep compiled kernels shared with normal runs.
+os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(HERE, "numba_cache"))
+# benchmark pins one scoring worker on import, a load test has to see com5's own default.
+os.environ.setdefault("SCORING_WORKERS", str(os.cpu_count() or 1))
+
+import numpy as np
+import soundfile as sf
+
+from benchmark import BENCH_SR, machine_info, synth_fixture
+from key_benchmark import KEYS, synth_key_fixture
+
+SERVICES = {
+    "compare": "com5",
+    "keydetect": "KeyDetector",
+    "upload-song": "shift_splitting",
+}
+DEFAULT_MIX = "compare=8,keydetect=4,upload-song=1"
+SETTINGS = (
+    "SCORING_WORKERS", "SCORING_QUEUE_SIZE", "SCORING_TIMEOUT_SEC", "KEY_WORKERS", "KEY_DETECTION_MODE",
+    "PITCH_WORKERS", "INGEST_WORKERS", "INGEST_MODE", "FEATURE_SIDECARS", "PCM_CACHE_MAX_MB",
+    "FEATURE_ENGINE", "DTW_ENGINE", "ALIGN_MODE", "WARMUP",
+)
+BACKPRESSURE_STATUS = ("429", "503")
+BACKPRESSURE_BACKOFF_SEC = 0.5
+FIXTURE_SEC = 40
+SEPARATOR_RTF = 0.1
+SAMPLE_INTERVAL_SEC = 0.5
+JOB_POLL_SEC = 0.5
+JOB_TIMEOUT_SEC = 1800
+READY_TIMEOUT_SEC = 900
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class StandInSeparator:
+    # Mid/side split in place of Spleeter 2stems, burning CPU for rtf seconds per second of audio.
+    def __init__(self, rtf=SEPARATOR_RTF, sr=44100):
+        self.rtf = rtf
+        self.sr = sr
+
+    def separate(self, waveform):
+        deadline = time.perf_counter() + self.rtf * len(waveform) / self.sr
+        mid = np.mean(waveform, axis=1, keepdims=True)
+        vocals = np.repeat(mid, waveform.shape[1], axis=1)
+        accompaniment = waveform - vocals
+        block = np.ascontiguousarray(mid[:min(len(mid), 1 << 16), 0])
+        while time.perf_counter() < deadline:
+            np.fft.irfft(np.fft.rfft(block))
+        return {"vocals": vocals.astype(np.float32), "accompaniment": accompaniment.astype(np.float32)}
+
+
+def _wav_bytes(y, sr):
+    buf = io.BytesIO()
+    sf.write(buf, y, sr, format="WAV", subtype="PCM_16")
+    return buf.getvalue()
+
+
+def _variant(y, seq):
+    # A few LSBs on one sample: same audio, new content hash, so no cache answers for it.
+    y = y.copy()
+    y[(seq * 7919) % len(y)] += 4 / 32768
+    return y
+
+
+def write_load_fixtures(target_dir, seconds, seed=0):
+    os.makedirs(target_dir, exist_ok=True)
+    tonic, mode = KEYS[seed % len(KEYS)]
+    reference = synth_fixture("reference", seconds, seed=seed)
+    take = synth_fixture("pitch", seconds, seed=seed)
+    song = synth_key_fixture(tonic, mode, seconds, sr=BENCH_SR, seed=seed)
+    master = np.stack([song + 0.5 * reference, 0.6 * song + 0.5 * reference], axis=1)
+    fixtures = {"reference": reference, "take": take, "song": song, "master": master}
+    for name, y in fixtures.items():
+        fixtures[name] = y = np.clip(y, -1.0, 1.0).astype(np.float32)
+        sf.write(os.path.join(target_dir, f"{name}.wav"), y, BENCH_SR, subtype="PCM_16")
+    fixtures["dir"] = target_dir
+    return fixtures
+
+
+def _upload(fixtures, name, seq, cold):
+    y = _variant(fixtures[name], seq) if cold else fixtures[name]
+    return _wav_bytes(y, BENCH_SR)
+
+
+def request_compare(client, fixtures, seq, cold):
+    user_path = os.path.join(fixtures["dir"], "take.wav")
+    if cold:
+        user_path = os.path.join(fixtures["dir"], f"take-{seq}.wav")
+        sf.write(user_path, _variant(fixtures["take"], seq), BENCH_SR, subtype="PCM_16")
+    try:
+        t0 = time.perf_counter()
+        resp = client.post("/compare", json={
+            "originalSongPath": os.path.join(fixtures["dir"], "reference.wav"),
+            "userSongPath": user_path,
+        })
+        latency = time.perf_counter() - t0
+        return latency, resp.status_code, resp.status_code == 200 and resp.json().get("success") is True
+    finally:
+        if cold:
+            os.remove(user_path)
+
+
+def request_keydetect(client, fixtures, seq, cold):
+    data = _upload(fixtures, "song", seq, cold)
+    t0 = time.perf_counter()
+    resp = client.post("/keydetect", files={"file": ("song.wav", data)})
+    latency = time.perf_counter() - t0
+    return latency, resp.status_code, resp.status_code == 200 and resp.json().get("success") is True
+
+
+def request_upload_song(client, fixtures, seq, cold):
+    data = _upload(fixtures, "master", seq, cold)
+    t0 = time.perf_counter()
+    resp = client.post("/upload-song", files={"song": ("master.wav", data)}, data={"song_name": f"load-{seq}"})
+    if resp.status_code != 202:
+        return time.perf_counter() - t0, resp.status_code, False
+    job_id = resp.json()["job_id"]
+    while time.perf_counter() - t0 < JOB_TIMEOUT_SEC:
+        status = client.get(f"/upload-song/{job_id}").json()["status"]
+        if status in ("success", "error"):
+            return time.perf_counter() - t0, status, status == "success"
+        time.sleep(JOB_POLL_SEC)
+    return time.perf_counter() - t0, "timeout", False
+
+
+REQUESTS = {
+    "compare": request_compare,
+    "keydetect": request_keydetect,
+    "upload-song": request_upload_song,
+}
+
+
+def _proc_table():
+    table = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        fields = stat[stat.rindex(")") + 2:].split()
+        table[int(entry)] = (int(fields[1]), (int(fields[11]) + int(fields[12])) / CLK_TCK)
+    return table
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return 0
+
+
+class ProcessTreeSampler:
+    def __init__(self, roots, interval=SAMPLE_INTERVAL_SEC):
+        self.roots = roots
+        self.interval = interval
+        self._cpu = {name: {} for name in roots}
+        self._base = {name: {} for name in roots}
+        self._peak = {name: 0 for name in roots}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _sample(self):
+        table = _proc_table()
+        children = {}
+        for pid, (ppid, _) in table.items():
+            children.setdefault(ppid, []).append(pid)
+        for name, root in self.roots.items():
+            pids, todo = [], [root]
+            while todo:
+                pid = todo.pop()
+                if pid in table:
+                    pids.append(pid)
+                    todo.extend(children.get(pid, ()))
+            self._peak[name] = max(self._peak[name], sum(_rss_bytes(pid) for pid in pids))
+            self._cpu[name].update((pid, table[pid][1]) for pid in pids)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._sample()
+        self._base = {name: dict(cpu) for name, cpu in self._cpu.items()}
+        self._peak = {name: 0 for name in self.roots}
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return {
+            name: {
+                "cpu_s": round(sum(cpu - self._base[name].get(pid, 0.0) for pid, cpu in self._cpu[name].items()), 2),
+                "peak_rss_mb": round(self._peak[name] / 2 ** 20, 1),
+            }
+            for name in self.roots
+        }
+
+
+def _wait_ready(client, name, timeout, proc=None):
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"{name} exited with code {proc.returncode} during startup")
+        try:
+            resp = client.get("/ready")
+        except Exception:
+            resp = None
+        if resp is not None and resp.status_code == 200:
+            return resp.json()
+        if resp is not None and resp.json().get("status") == "failed":
+            raise RuntimeError(f"{name} failed to start: {resp.json().get('message')}")
+        time.sleep(0.5)
+    raise RuntimeError(f"{name} not ready after {timeout:.0f}s")
+
+
+def _load_service(module, separator_rtf):
+    mod = importlib.import_module(module)
+    if module == "shift_splitting":
+        mod.separator._separator = StandInSeparator(separator_rtf, mod.SEPARATOR_SR)
+    return mod
+
+
+@contextlib.contextmanager
+def inprocess_services(endpoints, workdir, separator_rtf, ready_timeout):
+    from fastapi.testclient import TestClient
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with contextlib.ExitStack() as stack:
+            clients, startup = {}, {}
+            for endpoint in endpoints:
+                mod = _load_service(SERVICES[endpoint], separator_rtf)
+                clients[endpoint] = stack.enter_context(TestClient(mod.app))
+            for endpoint, client in clients.items():
+                startup[endpoint] = _wait_ready(client, SERVICES[endpoint], ready_timeout)
+            yield clients, {"harness": os.getpid()}, startup
+    finally:
+        os.chdir(cwd)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def server_services(endpoints, workdir, separator_rtf, ready_timeout):
+    import httpx
+    procs, clients, startup = {}, {}, {}
+    try:
+        for endpoint in endpoints:
+            module, port = SERVICES[endpoint], _free_port()
+            with open(os.path.join(workdir, f"{module}.log"), "w") as log:
+                procs[endpoint] = subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), "serve", module,
+                     "--port", str(port), "--separator-rtf", str(separator_rtf)],
+                    cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+                )
+            clients[endpoint] = httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=None)
+        for endpoint, client in clients.items():
+            startup[endpoint] = _wait_ready(client, SERVICES[endpoint], ready_timeout, procs[endpoint])
+        yield clients, {endpoint: proc.pid for endpoint, proc in procs.items()}, startup
+    finally:
+        for client in clients.values():
+            client.close()
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def run_load(clients, fixtures, mix, concurrency, duration, max_requests, cold, seed):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    seqs = itertools.count()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def virtual_user(uid):
+        rng = random.Random(seed * 1000 + uid)
+        while time.perf_counter() < deadline:
+            with lock:
+                seq = next(seqs)
+            if max_requests and seq >= max_requests:
+                return
+            name = rng.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                latency, status, ok = REQUESTS[name](clients[name], fixtures, seq, cold)
+            except Exception as e:
+                latency, status, ok = time.perf_counter() - t0, type(e).__name__, False
+            with lock:
+                samples[name].append((latency, str(status), ok))
+            if str(status) in BACKPRESSURE_STATUS:
+                time.sleep(BACKPRESSURE_BACKOFF_SEC)
+
+    t0 = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(virtual_user, range(concurrency)))
+    return samples, time.perf_counter() - t0
+
+
+def summarize_endpoint(entries, wall, resources=None):
+    latencies = np.array([latency for latency, _, ok in entries if ok])
+    status = {}
+    for _, code, _ in entries:
+        status[code] = status.get(code, 0) + 1
+    ok = len(latencies)
+    rejected = sum(n for code, n in status.items() if code in BACKPRESSURE_STATUS)
+    stats = {
+        "requests": len(entries),
+        "ok": ok,
+        "rejected": rejected,
+        "errors": len(entries) - ok - rejected,
+        "status": status,
+        "throughput_rps": round(ok / wall, 4) if wall else 0.0,
+    }
+    for name, q in (("p50_s", 50), ("p95_s", 95), ("p99_s", 99)):
+        stats[name] = round(float(np.percentile(latencies, q)), 4) if ok else None
+    stats["mean_s"] = round(float(np.mean(latencies)), 4) if ok else None
+    if resources is not None:
+        stats.update(resources, cpu_util=round(resources["cpu_s"] / wall, 3) if wall else 0.0)
+    return stats
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def format_report(report):
+    lines = [f"{'endpoint':<14}{'reqs':>6}{'ok':>6}{'rej':>5}{'err':>5}{'rps':>8}{'p50_s':>9}{'p95_s':>9}"
+             f"{'p99_s':>9}{'cpu_s':>9}{'cpu%':>7}{'rss_mb':>9}"]
+    for name, s in report["endpoints"].items():
+        lines.append(f"{name:<14}{s['requests']:>6}{s['ok']:>6}{s['rejected']:>5}{s['errors']:>5}"
+                     f"{s['throughput_rps']:>8.3f}{_fmt(s['p50_s'], '.3f'):>9}{_fmt(s['p95_s'], '.3f'):>9}"
+                     f"{_fmt(s['p99_s'], '.3f'):>9}{_fmt(s.get('cpu_s'), '.1f'):>9}"
+                     f"{_fmt(s.get('cpu_util') and 100 * s['cpu_util'], '.0f'):>7}"
+                     f"{_fmt(s.get('peak_rss_mb'), '.1f'):>9}")
+    for name, r in report.get("processes", {}).items():
+        lines.append(f"{name + ' (all)':<14}{'':>57}{r['cpu_s']:>9.1f}{100 * r['cpu_util']:>7.0f}{r['peak_rss_mb']:>9.1f}")
+    lines.append(f"{report['config']['mode']} mode, {report['config']['concurrency']} user(s), "
+                 f"{report['wall_s']:.1f}s wall, {report['config']['cache']} caches")
+    return "\n".join(lines)
+
+
+def compare_reports(report, baseline):
+    lines = [f"{'endpoint':<14}{'rps':>8}{'base':>8}{'p95_s':>9}{'base':>9}{'rss_mb':>9}{'base':>9}  p95 change"]
+    for name, s in report["endpoints"].items():
+        b = baseline.get("endpoints", {}).get(name)
+        if b is None:
+            lines.append(f"{name:<14}{s['throughput_rps']:>8.3f}{'-':>8}{_fmt(s['p95_s'], '.3f'):>9}{'-':>9}"
+                         f"{_fmt(s.get('peak_rss_mb'), '.1f'):>9}{'-':>9}  new")
+            continue
+        change = "-"
+        if s["p95_s"] is not None and b["p95_s"]:
+            change = f"{100 * (s['p95_s'] / b['p95_s'] - 1):+.0f}%"
+        lines.append(f"{name:<14}{s['throughput_rps']:>8.3f}{b['throughput_rps']:>8.3f}"
+                     f"{_fmt(s['p95_s'], '.3f'):>9}{_fmt(b['p95_s'], '.3f'):>9}"
+                     f"{_fmt(s.get('peak_rss_mb'), '.1f'):>9}{_fmt(b.get('peak_rss_mb'), '.1f'):>9}  {change}")
+    config, base_config = report["config"], baseline.get("config", {})
+    for key in sorted(set(config) | set(base_config)):
+        if key == "settings":
+            settings, base_settings = config.get(key, {}), base_config.get(key, {})
+            for name in sorted(set(settings) | set(base_settings)):
+                if settings.get(name) != base_settings.get(name):
+                    lines.append(f"setting {name}: {base_settings.get(name)} -> {settings.get(name)}")
+        elif config.get(key) != base_config.get(key):
+            lines.append(f"config {key}: {base_config.get(key)} -> {config.get(key)}")
+    if baseline.get("machine") != report["machine"]:
+        lines.append(f"note: baseline recorded on {baseline.get('machine')}")
+    return "\n".join(lines)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in filter(None, text.split(",")):
+        name, _, weight = part.partition("=")
+        if name not in SERVICES:
+            raise ValueError(f"unknown endpoint '{name}', expected any of {list(SERVICES)}")
+        mix[name] = float(weight or 1)
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+    if not mix:
+        raise ValueError("empty request mix")
+    return mix
+
+
+def serve(argv):
+    parser = argparse.ArgumentParser(description="Run one audio service on uvicorn for the load test")
+    parser.add_argument("module", choices=sorted(SERVICES.values()))
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--separator-rtf", type=float, default=SEPARATOR_RTF)
+    args = parser.parse_args(argv)
+    import uvicorn
+    mod = _load_service(args.module, args.separator_rtf)
+    uvicorn.run(mod.app, host="127.0.0.1", port=args.port, log_level="warning")
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["serve"]:
+        return serve(argv[1:])
+    parser = argparse.ArgumentParser(description="Concurrent /compare, /keydetect and /upload-song load against local services")
+    parser.add_argument("--mode", choices=("server", "inprocess"), default="server",
+                        help="uvicorn subprocess per service (per-endpoint CPU/RSS) or all apps in this process")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight pairs, comma separated")
+    parser.add_argument("--concurrency", type=int, default=4, help="closed-loop virtual users")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to keep issuing requests")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 for no cap)")
+    parser.add_argument("--seconds", type=int, default=FIXTURE_SEC, help="length of the synthetic audio fixtures")
+    parser.add_argument("--cache", choices=("cold", "warm"), default="cold",
+                        help="cold makes every upload and take unique so content-hash caches miss")
+    parser.add_argument("--separator-rtf", type=float, default=SEPARATOR_RTF,
+                        help="CPU seconds the stand-in separator burns per second of audio")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="service setting for this run, e.g. SCORING_WORKERS=4")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--output", default=None, help="report path, default load_reports/<time>-<label>.json")
+    parser.add_argument("--baseline", default=None, help="earlier report to compare against")
+    parser.add_argument("--workdir", default=None, help="service working directory, default a temporary one")
+    parser.add_argument("--ready-timeout", type=float, default=READY_TIMEOUT_SEC)
+    args = parser.parse_args(argv)
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    for item in args.env:
+        name, sep, value = item.partition("=")
+        if not sep:
+            parser.error(f"--env expects NAME=VALUE, got '{item}'")
+        os.environ[name] = value
+    if args.seconds < 35 and "compare" in mix:
+        parser.error("/compare rejects takes under 30s of singing, use --seconds 35 or more")
+
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory(prefix="singo-load-"))
+        os.makedirs(workdir, exist_ok=True)
+        fixtures = write_load_fixtures(os.path.join(os.path.abspath(workdir), "fixtures"), args.seconds, args.seed)
+        services = inprocess_services if args.mode == "inprocess" else server_services
+        with services(list(mix), os.path.abspath(workdir), args.separator_rtf, args.ready_timeout) as (clients, roots, startup):
+            sampler = ProcessTreeSampler(roots).start()
+            samples, wall = run_load(clients, fixtures, mix, args.concurrency, args.duration,
+                                     args.requests, args.cache == "cold", args.seed)
+            resources = sampler.stop()
+
+    report = {
+        "label": args.label,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": machine_info(),
+        "config": {
+            "mode": args.mode,
+            "mix": mix,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "requests": args.requests,
+            "seconds": args.seconds,
+            "cache": args.cache,
+            "separator_rtf": args.separator_rtf,
+            "seed": args.seed,
+            "settings": {name: os.environ.get(name) for name in SETTINGS},
+        },
+        "startup": startup,
+        "wall_s": round(wall, 3),
+        "endpoints": {
+            name: summarize_endpoint(samples[name], wall, resources.get(name)) for name in mix
+        },
+    }
+    if args.mode == "inprocess":
+        report["processes"] = {
+            name: dict(r, cpu_util=round(r["cpu_s"] / wall, 3) if wall else 0.0) for name, r in resources.items()
+        }
+    output = args.output or os.path.join("load_reports", f"{time.strftime('%Y%m%d-%H%M%S')}-{args.label}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(format_report(report))
+    print(f"report written to {output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            print(compare_reports(report, json.load(f)))
+    return 1 if any(s["errors"] for s in report["endpoints"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
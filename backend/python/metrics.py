@@ -0,0 +1,144 @@
+import os
+import time
+import uuid
+import random
+import logging
+import functools
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.05"))
+REQUEST_ID_HEADER = "X-Request-ID"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+STAGE_SECONDS = Histogram(
+    "singo_stage_seconds", "Wall time spent in one audio pipeline stage",
+    ["service", "stage"], buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "singo_request_seconds", "End-to-end HTTP request latency",
+    ["service", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+REJECTIONS = Counter(
+    "singo_rejections_total", "Recordings rejected before full scoring",
+    ["service", "reason"],
+)
+QUEUE_DEPTH = Gauge(
+    "singo_queue_depth", "Jobs admitted and not yet finished",
+    ["service", "queue"],
+)
+
+_service = {"name": "audio"}
+_request_id = contextvars.ContextVar("request_id", default="-")
+_sampled = contextvars.ContextVar("log_sampled", default=False)
+_events = contextvars.ContextVar("metric_events", default=None)
+
+
+def service_name():
+    return _service["name"]
+
+
+def request_id():
+    return _request_id.get()
+
+
+def log_sampled():
+    return _sampled.get()
+
+
+def bind_request(rid=None, sampled=None):
+    rid = rid or uuid.uuid4().hex
+    if sampled is None:
+        sampled = random.random() < LOG_SAMPLE_RATE
+    _request_id.set(rid)
+    _sampled.set(bool(sampled))
+    return rid
+
+
+def debug(msg, *args):
+    if _sampled.get() or logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.info("[%s] " + msg, _request_id.get(), *args)
+
+
+def _apply(event):
+    if event[0] == "stage":
+        STAGE_SECONDS.labels(_service["name"], event[1]).observe(event[2])
+    elif event[0] == "reject":
+        REJECTIONS.labels(_service["name"], event[1]).inc()
+
+
+def _record(event):
+    events = _events.get()
+    if events is None:
+        _apply(event)
+    else:
+        events.append(event)
+
+
+def replay(events):
+    for event in events or ():
+        _apply(tuple(event))
+
+
+@contextmanager
+def collect():
+    events = []
+    token = _events.set(events)
+    try:
+        yield events
+    finally:
+        _events.reset(token)
+
+
+@contextmanager
+def stage(name):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(("stage", name, time.perf_counter() - t0))
+
+
+def timed(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def rejected(reason):
+    _record(("reject", reason))
+
+
+def queue_depth(queue, value):
+    QUEUE_DEPTH.labels(_service["name"], queue).set(value)
+
+
+def install(app, service):
+    from fastapi import Request
+    from fastapi.responses import Response
+
+    _service["name"] = service
+
+    @app.middleware("http")
+    async def request_metrics(request: Request, call_next):
+        rid = bind_request(request.headers.get(REQUEST_ID_HEADER))
+        t0 = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.labels(service, route, str(status)).observe(time.perf_counter() - t0)
+        response.headers[REQUEST_ID_HEADER] = rid
+        return response
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
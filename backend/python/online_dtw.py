@@ -0,0 +1,98 @@
+import numpy as np
+import librosa
+
+from dtw_engine import hybrid_cost
+
+
+class StreamingFrameExtractor:
+    def __init__(self, sr, n_fft, hop):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop = hop
+        self.window = librosa.filters.get_window("hann", n_fft, fftbins=True).astype(np.float32)
+        self.chroma_fb = librosa.filters.chroma(sr=sr, n_fft=n_fft, tuning=0.0).astype(np.float32)
+        self._buf = np.zeros(n_fft // 2, dtype=np.float32)
+
+    def _empty(self):
+        return (np.zeros((12, 0), dtype=np.float32),
+                np.zeros(0, dtype=np.float32),
+                np.zeros(0, dtype=np.float32))
+
+    def _features(self, frames):
+        rms = np.sqrt(np.mean(frames ** 2, axis=0)).astype(np.float32)
+        power = np.abs(np.fft.rfft(frames * self.window[:, None], axis=0)) ** 2
+        chroma = (self.chroma_fb @ power).astype(np.float32)
+        peak = np.max(chroma, axis=0)
+        nz = peak > np.finfo(np.float32).tiny
+        chroma[:, nz] /= peak[nz]
+        power = np.maximum(1e-10, power)
+        flatness = (np.exp(np.mean(np.log(power), axis=0)) / np.mean(power, axis=0)).astype(np.float32)
+        return chroma, rms, flatness
+
+    def push(self, y, last=False):
+        buf = np.concatenate((self._buf, np.asarray(y, dtype=np.float32)))
+        if last:
+            buf = np.concatenate((buf, np.zeros(self.n_fft // 2, dtype=np.float32)))
+        if len(buf) < self.n_fft:
+            self._buf = buf
+            return self._empty()
+        frames = librosa.util.frame(buf, frame_length=self.n_fft, hop_length=self.hop)
+        self._buf = buf[frames.shape[1] * self.hop:]
+        return self._features(frames)
+
+
+class OnlineAligner:
+    def __init__(self, ref_unit, alpha, back_frames, ahead_frames):
+        self.ref = np.ascontiguousarray(ref_unit, dtype=np.float32)
+        self.n = self.ref.shape[1]
+        self.alpha = alpha
+        self.back = max(1, int(back_frames))
+        self.ahead = max(1, int(ahead_frames))
+        self.position = 0
+        self.frames = 0
+        self.total_cost = 0.0
+        self.path_orig = []
+        self.path_user = []
+        self._prev = None
+        self._prev_lo = 0
+
+    def step(self, u):
+        lo = max(0, self.position - self.back)
+        hi = min(self.n - 1, self.position + self.ahead)
+        cost = hybrid_cost(self.ref[:, lo:hi + 1].T @ u, self.alpha)
+        csum = np.cumsum(cost)
+        if self._prev is None:
+            col = csum if lo == 0 else np.full(cost.size, np.inf)
+        else:
+            prev, prev_lo = self._prev, self._prev_lo
+            prev_hi = prev_lo + prev.size - 1
+            same = np.full(cost.size, np.inf)
+            a, b = max(lo, prev_lo), min(hi, prev_hi)
+            if a <= b:
+                same[a - lo:b - lo + 1] = prev[a - prev_lo:b - prev_lo + 1]
+            diag = np.full(cost.size, np.inf)
+            a, b = max(lo, prev_lo + 1), min(hi, prev_hi + 1)
+            if a <= b:
+                diag[a - lo:b - lo + 1] = prev[a - 1 - prev_lo:b - prev_lo]
+            entry = cost + np.minimum(diag, same)
+            col = np.minimum.accumulate(entry - csum) + csum
+        normalized = col / (np.arange(lo, hi + 1) + self.frames + 2)
+        best = lo + int(np.argmin(normalized))
+        self.position = max(self.position, best)
+        self.total_cost += float(cost[self.position - lo])
+        self.path_orig.append(self.position)
+        self.path_user.append(self.frames)
+        self._prev, self._prev_lo = col, lo
+        self.frames += 1
+
+    def extend(self, user_unit):
+        for j in range(user_unit.shape[1]):
+            self.step(np.ascontiguousarray(user_unit[:, j]))
+
+    @property
+    def normalized_distance(self):
+        return self.total_cost / max(1, self.frames)
+
+    def path_arrays(self):
+        return (np.asarray(self.path_orig, dtype=np.int64),
+                np.asarray(self.path_user, dtype=np.int64))
@@ -0,0 +1,159 @@
+import os
+import shutil
+import importlib
+import logging
+import tempfile
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import librosa
+import soundfile as sf
+
+import metrics
+import warmup
+
+PITCH_N_FFT = 2048
+PITCH_HOP = PITCH_N_FFT // 4
+PITCH_RES_TYPE = "soxr_hq"
+PITCH_WORKERS = int(os.environ.get("PITCH_WORKERS", str(os.cpu_count() or 1)))
+PITCH_START_METHOD = os.environ.get("PITCH_START_METHOD", "spawn")
+PITCH_PCM_DIR = os.environ.get("PITCH_PCM_DIR") or None
+
+
+def analyze(y, n_fft=PITCH_N_FFT, hop=PITCH_HOP):
+    return librosa.stft(np.asarray(y, dtype=np.float32), n_fft=n_fft, hop_length=hop)
+
+
+def synthesize(D, n_samples, sr, n_steps, n_fft=PITCH_N_FFT, hop=PITCH_HOP):
+    # Same chain as librosa.effects.pitch_shift, starting from a forward STFT shared across keys.
+    rate = 2.0 ** (-float(n_steps) / 12)
+    stretched = librosa.phase_vocoder(D, rate=rate, hop_length=hop, n_fft=n_fft)
+    y = librosa.istft(stretched, n_fft=n_fft, hop_length=hop, dtype=np.float32,
+                      length=int(round(n_samples / rate)))
+    y = librosa.resample(y, orig_sr=float(sr) / rate, target_sr=sr, res_type=PITCH_RES_TYPE)
+    return librosa.util.fix_length(y, size=n_samples)
+
+
+def write_audio(path, y, sr, **write_kwargs):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    sf.write(path, y.T if y.ndim > 1 else y, sr, **write_kwargs)
+
+
+def _render_shifts(pcm_dir, n_samples, sr, shifts, n_fft, hop, names, write_kwargs):
+    # One forward STFT per source, shared by every key this worker renders.
+    with metrics.collect() as events:
+        mixes = {}
+        for name in names:
+            y = np.load(os.path.join(pcm_dir, f"{name}.npy"), mmap_mode="r")
+            with metrics.stage("pitch_analysis"):
+                D = analyze(y, n_fft, hop)
+            del y
+            for n_steps, (paths, mix_path) in shifts.items():
+                with metrics.stage("pitch_shift"):
+                    shifted = synthesize(D, n_samples, sr, n_steps, n_fft, hop)
+                if paths.get(name) is not None:
+                    write_audio(paths[name], shifted, sr, **write_kwargs)
+                if mix_path is not None:
+                    mixes[n_steps] = shifted + mixes[n_steps] if n_steps in mixes else shifted
+            del D
+        for n_steps, (_, mix_path) in shifts.items():
+            if mix_path is not None:
+                write_audio(mix_path, np.clip(mixes.pop(n_steps), -1.0, 1.0), sr)
+    return list(shifts), events
+
+
+def _call(target, *args):
+    module, name = target.split(":")
+    return getattr(importlib.import_module(module), name)(*args)
+
+
+def warm_up_pitch_shift(sr=22050, n_steps=1):
+    y = warmup.synthetic_voice(sr)
+    synthesize(analyze(y), len(y), sr, n_steps)
+
+
+def _init_pitch_worker(warm_up_targets=()):
+    logging.basicConfig(level=logging.INFO)
+    warmup.warm_worker(warm_up_pitch_shift)
+    for target in warm_up_targets:
+        warmup.warm_worker(_call, target)
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+class PitchShiftEngine:
+    def __init__(self, workers=PITCH_WORKERS, n_fft=PITCH_N_FFT, hop=PITCH_HOP, warm_up_targets=()):
+        self.workers = max(1, workers)
+        self.n_fft = n_fft
+        self.hop = hop
+        self.warm_up_targets = tuple(warm_up_targets)
+        self._executor = None
+
+    def start(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(PITCH_START_METHOD),
+                initializer=_init_pitch_worker,
+                initargs=(self.warm_up_targets,),
+            )
+            pids = {f.result() for f in [self._executor.submit(_worker_ready) for _ in range(self.workers)]}
+            logging.info(f"Pitch-shift pool ready with {len(pids)} worker process(es)")
+        return self
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def submit(self, target, *args):
+        try:
+            return self.start()._executor.submit(_call, target, *args)
+        except BrokenProcessPool:
+            # A worker died since the last job: rebuild the pool and resubmit once.
+            logging.warning("Pitch-shift pool is broken, restarting it")
+            self.stop()
+            return self.start()._executor.submit(_call, target, *args)
+
+    def shift_all(self, sources, sr, outputs, mix_paths=None, write_kwargs=None):
+        if not outputs:
+            return
+        mix_paths = mix_paths or {}
+        n_samples = {np.shape(y)[-1] for y in sources.values()}
+        if len(n_samples) != 1:
+            raise ValueError("all sources must have the same length")
+        n_samples = n_samples.pop()
+        pcm_dir = tempfile.mkdtemp(prefix="pitch-", dir=PITCH_PCM_DIR)
+        futures = []
+        try:
+            for name, y in sources.items():
+                np.save(os.path.join(pcm_dir, f"{name}.npy"), np.ascontiguousarray(y, dtype=np.float32))
+            # Each worker takes a share of the keys, so a source is analysed once per worker, not once per key.
+            keys = list(outputs)
+            groups = [keys[i::self.workers] for i in range(min(self.workers, len(keys)))]
+            self.start()
+            try:
+                futures += [
+                    self._executor.submit(
+                        _render_shifts, pcm_dir, n_samples, sr,
+                        {steps: (outputs[steps], mix_paths.get(steps)) for steps in group},
+                        self.n_fft, self.hop, list(sources), write_kwargs or {},
+                    )
+                    for group in groups
+                ]
+                for fut in concurrent.futures.as_completed(futures):
+                    shifts, events = fut.result()
+                    metrics.replay(events)
+                    yield from shifts
+            except BrokenProcessPool:
+                self.stop()
+                raise
+        finally:
+            for fut in futures:
+                fut.cancel()
+            concurrent.futures.wait(futures)
+            shutil.rmtree(pcm_dir, ignore_errors=True)
@@ -2,22 +2,47 @@ import uvicorn
 import os
 import shutil
 import re
-import librosa
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import concurrent.futures
+import warmup
+import numpy as np
 import soundfile as sf
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, UploadFile, Form
 from fastapi.responses import JSONResponse
-from spleeter.separator import Separator
-import requests
 import gc
+import metrics
+import audio_cache
+from audio_cache import file_sha256
+from feature_store import META_FILE, source_stamp
+from key_detection import detect_key_cached, warm_up_key_detection
+from pitch_shift import PitchShiftEngine
 
 os.environ["TF_FORCE_GPU_ALLOW_GROWTH"] = "true"
 os.environ["TF_NUM_INTRAOP_THREADS"] = "1"
 os.environ["TF_NUM_INTEROP_THREADS"] = "1"
 
-app = FastAPI()
-
 BASE_DIR = "song"
 
+SPLEETER_MODEL = "spleeter:2stems"
+SEPARATOR_SR = 44100
+
+INGEST_MODES = ("separate_first", "shift_first")
+INGEST_MODE = os.environ.get("INGEST_MODE", "separate_first")
+INGEST_STATE_DIR = os.environ.get("INGEST_STATE_DIR", "ingest_jobs")
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "1"))
+UPLOAD_CHUNK_SIZE = 1 << 20
+FEATURE_SIDECARS = os.environ.get("FEATURE_SIDECARS", "1") == "1"
+FEATURE_SIDECAR_SUFFIX = os.environ.get("FEATURE_SIDECAR_SUFFIX", ".features")
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
 SHIFTS = list(range(-3, 4))
 
 NOTES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
@@ -55,97 +80,475 @@ def shift_key(original_key: str, steps: int) -> str:
     new_idx = (idx + steps) % 12
     return NOTES[new_idx]
 
-def change_pitch_librosa(input_file: str, output_file: str, pitch_steps: int):
-    y, sr = librosa.load(input_file, sr=None)
-    y_shifted = librosa.effects.pitch_shift(y, sr=sr, n_steps=pitch_steps)
-    sf.write(output_file, y_shifted, sr)
-    del y, y_shifted
-    gc.collect()
-
-def create_versions(input_audio: str, song_name: str, original_key: str):
-    version_files = []
-    base_dir = os.path.join(BASE_DIR, song_name)
-    os.makedirs(base_dir, exist_ok=True)
-    for steps in SHIFTS:
-        new_key = shift_key(original_key, steps)
-        filename = f"{song_name}_{new_key}.mp3"
-        out_file = os.path.join(base_dir, filename)
+pitch_engine = PitchShiftEngine(warm_up_targets=["com5:warm_up_reference"] if FEATURE_SIDECARS else [])
+
+def version_file(song_name: str, new_key: str) -> str:
+    return os.path.join(BASE_DIR, song_name, f"{song_name}_{new_key}.mp3")
+
+def shift_versions(input_audio: str, song_name: str, original_key: str, shifts):
+    outputs = {steps: {"mix": version_file(song_name, shift_key(original_key, steps))}
+               for steps in shifts if steps != 0}
+    if 0 in shifts:
+        out_file = version_file(song_name, original_key)
         os.makedirs(os.path.dirname(out_file), exist_ok=True)
-        if steps == 0:
-            shutil.copy2(input_audio, out_file)
-        else:
-            change_pitch_librosa(input_audio, out_file, steps)
-        version_files.append((new_key, out_file, steps))
-    return version_files
+        shutil.copy2(input_audio, out_file)
+        yield 0
+    if outputs:
+        y, sr = audio_cache.load(input_audio, sr=None, mono=True)
+        yield from pitch_engine.shift_all({"mix": y}, sr, outputs)
+        del y
+        gc.collect()
+
+class WarmSeparator:
+    def __init__(self, model: str = SPLEETER_MODEL, mwf: bool = True):
+        self.model = model
+        self.mwf = mwf
+        self._separator = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._separator is None:
+                from spleeter.separator import Separator
+                separator = Separator(self.model, MWF=self.mwf, multiprocess=False)
+                separator.separate(np.zeros((SEPARATOR_SR, 2), dtype=np.float32))
+                self._separator = separator
+                logging.info(f"Separator {self.model} loaded and warm")
+        return self
+
+    def separate(self, waveform: np.ndarray) -> dict:
+        self.load()
+        waveform = np.asarray(waveform, dtype=np.float32)
+        if waveform.ndim == 1:
+            waveform = waveform[:, None]
+        if waveform.shape[1] == 1:
+            waveform = np.repeat(waveform, 2, axis=1)
+        with self._lock:
+            return self._separator.separate(waveform)
+
+separator = WarmSeparator()
+
+def load_stereo(file_path: str) -> np.ndarray:
+    waveform, _ = audio_cache.load(file_path, sr=SEPARATOR_SR, mono=False)
+    return waveform.T if waveform.ndim > 1 else waveform
+
+@metrics.timed("separation")
+def separate_waveform(waveform: np.ndarray) -> dict:
+    return separator.separate(waveform)
+
+def write_stem(out_path: str, stem: np.ndarray):
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    sf.write(out_path, stem, SEPARATOR_SR, format="WAV", subtype="PCM_16")
 
 def separate_audio(file_path: str, vocal_out: str, instru_out: str):
-    separator = Separator("spleeter:2stems", MWF=True)
-    temp_dir = os.path.dirname(vocal_out)
-    os.makedirs(temp_dir, exist_ok=True)
-    separator.separate_to_file(file_path, temp_dir)
-    sep_dir = os.path.join(temp_dir, os.path.splitext(os.path.basename(file_path))[0])
-    vocal_src = os.path.join(sep_dir, "vocals.wav")
-    instru_src = os.path.join(sep_dir, "accompaniment.wav")
-    if os.path.exists(vocal_src):
-        shutil.move(vocal_src, vocal_out)
-    if os.path.exists(instru_src):
-        shutil.move(instru_src, instru_out)
-    shutil.rmtree(sep_dir, ignore_errors=True)
-
-@app.post("/upload-song")
-async def upload_song(song: UploadFile, song_name: str = Form(...)):
+    stems = separate_waveform(load_stereo(file_path))
+    write_stem(vocal_out, stems["vocals"])
+    write_stem(instru_out, stems["accompaniment"])
+
+def _version_meta(song_name: str, new_key: str, semitone_shift: int):
+    vocal_path = os.path.join(BASE_DIR, song_name, "vocal", f"{new_key}.mp3")
+    instru_path = os.path.join(BASE_DIR, song_name, "instru", f"{new_key}.mp3")
+    is_original = (semitone_shift == 0)
+    separated = {
+        "key": new_key,
+        "status": "done",
+        "vocal_path": vocal_path,
+        "instru_path": instru_path,
+        "is_original": is_original,
+        "semitone_shift": semitone_shift
+    }
+    shift = {
+        "semitone_shift": semitone_shift,
+        "key": new_key,
+        "file": version_file(song_name, new_key),
+        "is_original": is_original
+    }
+    return separated, shift
+
+class IngestError(Exception):
+    def __init__(self, message: str, **extra):
+        super().__init__(message)
+        self.extra = extra
+
+def _job_path(job_id: str) -> str:
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", job_id):
+        raise ValueError(f"invalid job id '{job_id}'")
+    return os.path.join(INGEST_STATE_DIR, f"{job_id}.json")
+
+def save_job(job: dict):
+    os.makedirs(INGEST_STATE_DIR, exist_ok=True)
+    path = _job_path(job["job_id"])
+    tmp_path = f"{path}.tmp"
+    job["updated_at"] = time.time()
+    with open(tmp_path, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp_path, path)
+
+def load_job(job_id: str):
     try:
-        song_dir = os.path.join(BASE_DIR, song_name)
-        os.makedirs(song_dir, exist_ok=True)
-        input_path = os.path.join(song_dir, f"{song_name}.mp3")
-        with open(input_path, "wb") as f:
-            f.write(await song.read())
-        key_api = "http://localhost:8083/keydetect"
-        with open(input_path, "rb") as f:
-            resp = requests.post(key_api, files={"file": (f"{song_name}.mp3", f, "audio/mpeg")})
-        if resp.status_code != 200:
-            return JSONResponse(status_code=400, content={"status": "error", "message": "Key detection failed"})
-        key_result = resp.json()
-        original_raw = key_result.get("detectedKey", None)
-        if original_raw is None:
-            return JSONResponse(status_code=400, content={"status": "error", "message": "Key detection returned no key"})
+        with open(_job_path(job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _step_done(job: dict, step: str, semitone_shift=None) -> bool:
+    return any(s["step"] == step and s.get("semitone_shift") == semitone_shift for s in job["steps"])
+
+def _record_step(job: dict, step: str, semitone_shift=None, **extra):
+    job["steps"].append(dict(extra, step=step, semitone_shift=semitone_shift, at=time.time()))
+    save_job(job)
+    if not extra.get("reused") and not extra.get("error"):
+        _record_artifacts(job, step, semitone_shift)
+
+def _manifest_path(song_name: str) -> str:
+    return os.path.join(BASE_DIR, song_name, MANIFEST_FILE)
+
+def load_manifest(song_name: str):
+    try:
+        with open(_manifest_path(song_name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_manifest(song_name: str, manifest: dict):
+    path = _manifest_path(song_name)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _job_manifest(job: dict) -> dict:
+    manifest = load_manifest(job["song_name"])
+    if (manifest is None or manifest.get("version") != MANIFEST_VERSION
+            or manifest.get("input_sha256") != job["input_sha256"]):
+        manifest = {"version": MANIFEST_VERSION, "input_sha256": job["input_sha256"], "artifacts": {}}
+    if manifest.get("mode") != job["mode"]:
+        manifest.update(mode=job["mode"], artifacts={})
+    return manifest
+
+def _artifact_paths(job: dict, step: str, semitone_shift) -> list:
+    if step not in ("shifted", "separated", "features"):
+        return []
+    separated, shift = _version_meta(job["song_name"], shift_key(job["original_key"], semitone_shift), semitone_shift)
+    if step == "features":
+        # The sidecar directory is published by one rename, so its meta.json stands for the whole of it.
+        return [os.path.join(f"{separated['vocal_path']}{FEATURE_SIDECAR_SUFFIX}", META_FILE)]
+    stems = [separated["vocal_path"], separated["instru_path"]]
+    if step == "separated":
+        return stems
+    if job["mode"] == "separate_first" and semitone_shift != 0:
+        return [shift["file"]] + stems
+    return [shift["file"]]
+
+def _artifact_entry(path: str) -> dict:
+    st = os.stat(path)
+    return {"sha256": file_sha256(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def _artifact_valid(entry, path: str) -> bool:
+    if entry is None or not os.path.isfile(path):
+        return False
+    st = os.stat(path)
+    if st.st_size != entry["size"]:
+        return False
+    return st.st_mtime_ns == entry["mtime_ns"] or file_sha256(path) == entry["sha256"]
+
+def _record_artifacts(job: dict, step: str, semitone_shift):
+    if step == "key_detected":
+        manifest = _job_manifest(job)
+        manifest["original_detected_raw"] = job["original_detected_raw"]
+        manifest["original_key"] = job["original_key"]
+        save_manifest(job["song_name"], manifest)
+        return
+    paths = _artifact_paths(job, step, semitone_shift)
+    if not paths:
+        return
+    manifest = _job_manifest(job)
+    for path in paths:
+        manifest["artifacts"][os.path.relpath(path, os.path.join(BASE_DIR, job["song_name"]))] = dict(
+            _artifact_entry(path), step=step, semitone_shift=semitone_shift)
+    save_manifest(job["song_name"], manifest)
+
+def _vocal_step(job: dict, semitone_shift: int):
+    # The step that writes the vocal stem a feature sidecar is computed from.
+    if job["mode"] == "separate_first" and semitone_shift != 0:
+        return "shifted", semitone_shift
+    return "separated", semitone_shift
+
+def _sidecar_current(job: dict, semitone_shift: int, config_version) -> bool:
+    # Same test the scoring service applies before trusting a sidecar.
+    separated, _ = _version_meta(job["song_name"], shift_key(job["original_key"], semitone_shift), semitone_shift)
+    try:
+        with open(_artifact_paths(job, "features", semitone_shift)[0]) as f:
+            meta = json.load(f)
+        _, mtime_ns, size = source_stamp(separated["vocal_path"])
+    except (OSError, ValueError):
+        return False
+    return (meta.get("config_version") == config_version
+            and meta.get("source_mtime_ns") == mtime_ns and meta.get("source_size") == size)
+
+def _feature_config_version():
+    try:
+        return pitch_engine.submit("com5:feature_config_version").result()
+    except Exception as e:
+        logging.warning(f"[{metrics.request_id()}] Could not read the feature config version, sidecars will be rebuilt: {e}")
+        return None
+
+def _reuse_from_manifest(job: dict):
+    manifest = load_manifest(job["song_name"])
+    if (manifest is None or manifest.get("version") != MANIFEST_VERSION
+            or manifest.get("input_sha256") != job["input_sha256"] or not manifest.get("original_key")):
+        return
+    job["original_detected_raw"], job["original_key"] = manifest["original_detected_raw"], manifest["original_key"]
+    _record_step(job, "key_detected", key=job["original_key"], reused=True)
+    if manifest.get("mode") != job["mode"]:
+        return
+    song_dir = os.path.join(BASE_DIR, job["song_name"])
+    steps = [("separated", 0), *(("shifted", s) for s in SHIFTS)] if job["mode"] == "separate_first" else \
+        [(step, s) for s in SHIFTS for step in ("shifted", "separated")]
+    config_version = None
+    if FEATURE_SIDECARS and any(a.get("step") == "features" for a in manifest["artifacts"].values()):
+        config_version = _feature_config_version()
+    if config_version is not None:
+        steps += [("features", s) for s in SHIFTS]
+    reused = 0
+    for step, semitone_shift in steps:
+        paths = _artifact_paths(job, step, semitone_shift)
+        if not all(_artifact_valid(manifest["artifacts"].get(os.path.relpath(p, song_dir)), p) for p in paths):
+            continue
+        if step == "features" and not (_step_done(job, *_vocal_step(job, semitone_shift))
+                                       and _sidecar_current(job, semitone_shift, config_version)):
+            continue
+        _record_step(job, step, semitone_shift, key=shift_key(job["original_key"], semitone_shift), reused=True)
+        reused += 1
+    logging.info(f"[{metrics.request_id()}] Reusing {reused}/{len(steps)} ingest step(s) for '{job['song_name']}'")
+
+def _submit_sidecar(job: dict, futures: dict, semitone_shift: int, vocal_path: str):
+    if FEATURE_SIDECARS and not _step_done(job, "features", semitone_shift):
+        futures[pitch_engine.submit("com5:write_feature_sidecar", vocal_path)] = semitone_shift
+
+def _finish_sidecars(job: dict, futures: dict):
+    for fut in concurrent.futures.as_completed(futures):
+        semitone_shift = futures[fut]
         try:
-            original_key = parse_detected_key(original_raw)
-        except ValueError as ex:
-            return JSONResponse(status_code=400, content={"status": "error", "message": str(ex), "detectedRaw": original_raw})
-        versions = create_versions(input_path, song_name, original_key)
-        separated_meta = []
-        shifts_info = []
-        for new_key, version_path, semitone_shift in versions:
-            vocal_path = os.path.join(BASE_DIR, song_name, "vocal", f"{new_key}.mp3")
-            instru_path = os.path.join(BASE_DIR, song_name, "instru", f"{new_key}.mp3")
-            os.makedirs(os.path.dirname(vocal_path), exist_ok=True)
-            os.makedirs(os.path.dirname(instru_path), exist_ok=True)
-            separate_audio(version_path, vocal_path, instru_path)
-            is_original = (semitone_shift == 0)
-            separated_meta.append({
-                "key": new_key,
-                "status": "done",
-                "vocal_path": vocal_path,
-                "instru_path": instru_path,
-                "is_original": is_original,
-                "semitone_shift": semitone_shift
-            })
-            shifts_info.append({
-                "semitone_shift": semitone_shift,
-                "key": new_key,
-                "file": os.path.join(BASE_DIR, song_name, f"{song_name}_{new_key}.mp3"),
-                "is_original": is_original
-            })
-        return JSONResponse(content={
+            metrics.replay(fut.result())
+            _record_step(job, "features", semitone_shift)
+        except Exception as e:
+            logging.warning(f"[{metrics.request_id()}] Feature sidecar for shift {semitone_shift} failed: {e}")
+            _record_step(job, "features", semitone_shift, error=str(e))
+
+def detect_key(input_path: str, content_hash: str = None) -> str:
+    try:
+        return detect_key_cached(input_path, content_hash=content_hash)[0]
+    except Exception as e:
+        raise IngestError(f"Key detection failed: {e}")
+
+def ingest_shift_first(job: dict):
+    input_path, song_name, original_key = job["input_path"], job["song_name"], job["original_key"]
+    pending = [s for s in SHIFTS if not _step_done(job, "shifted", s)]
+    for semitone_shift in shift_versions(input_path, song_name, original_key, pending):
+        _record_step(job, "shifted", semitone_shift, key=shift_key(original_key, semitone_shift))
+    separated_meta = []
+    shifts_info = []
+    sidecars = {}
+    for semitone_shift in SHIFTS:
+        new_key = shift_key(original_key, semitone_shift)
+        separated, shift = _version_meta(song_name, new_key, semitone_shift)
+        if not _step_done(job, "separated", semitone_shift):
+            separate_audio(shift["file"], separated["vocal_path"], separated["instru_path"])
+            _record_step(job, "separated", semitone_shift, key=new_key)
+        _submit_sidecar(job, sidecars, semitone_shift, separated["vocal_path"])
+        separated_meta.append(separated)
+        shifts_info.append(shift)
+    _finish_sidecars(job, sidecars)
+    return separated_meta, shifts_info
+
+def _original_stems(job: dict) -> dict:
+    separated, _ = _version_meta(job["song_name"], job["original_key"], 0)
+    if _step_done(job, "separated", 0):
+        return {
+            "vocals": sf.read(separated["vocal_path"], dtype="float32", always_2d=True)[0],
+            "accompaniment": sf.read(separated["instru_path"], dtype="float32", always_2d=True)[0],
+        }
+    stems = separate_waveform(load_stereo(job["input_path"]))
+    write_stem(separated["vocal_path"], stems["vocals"])
+    write_stem(separated["instru_path"], stems["accompaniment"])
+    _record_step(job, "separated", 0, key=job["original_key"])
+    return stems
+
+def ingest_separate_first(job: dict):
+    input_path, song_name, original_key = job["input_path"], job["song_name"], job["original_key"]
+    versions = {s: _version_meta(song_name, shift_key(original_key, s), s) for s in SHIFTS}
+    pending = [s for s in SHIFTS if not _step_done(job, "shifted", s)]
+    sidecars = {}
+    for s in SHIFTS:
+        if s not in pending:
+            _submit_sidecar(job, sidecars, s, versions[s][0]["vocal_path"])
+    if pending:
+        stems = _original_stems(job)
+        if 0 in pending:
+            shutil.copy2(input_path, versions[0][1]["file"])
+            _record_step(job, "shifted", 0, key=original_key)
+            _submit_sidecar(job, sidecars, 0, versions[0][0]["vocal_path"])
+        sources = {"vocals": stems["vocals"].T, "accompaniment": stems["accompaniment"].T}
+        outputs = {s: {"vocals": versions[s][0]["vocal_path"], "accompaniment": versions[s][0]["instru_path"]}
+                   for s in pending if s != 0}
+        mix_paths = {s: versions[s][1]["file"] for s in outputs}
+        for semitone_shift in pitch_engine.shift_all(sources, SEPARATOR_SR, outputs, mix_paths,
+                                                     {"format": "WAV", "subtype": "PCM_16"}):
+            _record_step(job, "shifted", semitone_shift, key=shift_key(original_key, semitone_shift))
+            _submit_sidecar(job, sidecars, semitone_shift, versions[semitone_shift][0]["vocal_path"])
+        del stems, sources
+        gc.collect()
+    _finish_sidecars(job, sidecars)
+    separated_meta = [versions[s][0] for s in SHIFTS]
+    shifts_info = [versions[s][1] for s in SHIFTS]
+    return separated_meta, shifts_info
+
+def run_ingest_job(job_id: str):
+    job = load_job(job_id)
+    if job is None or job["status"] in ("success", "error"):
+        return
+    metrics.bind_request(job.get("request_id"))
+    job["status"] = "running"
+    save_job(job)
+    try:
+        if "input_sha256" not in job:
+            job["input_sha256"] = file_sha256(job["input_path"])
+        if not job["steps"]:
+            _reuse_from_manifest(job)
+        if not _step_done(job, "key_detected"):
+            original_raw = detect_key(job["input_path"], job["input_sha256"])
+            try:
+                original_key = parse_detected_key(original_raw)
+            except ValueError as ex:
+                raise IngestError(str(ex), detectedRaw=original_raw)
+            job["original_detected_raw"], job["original_key"] = original_raw, original_key
+            _record_step(job, "key_detected", key=original_key)
+        if job["mode"] == "separate_first":
+            separated_meta, shifts_info = ingest_separate_first(job)
+        else:
+            separated_meta, shifts_info = ingest_shift_first(job)
+        job.update({
             "status": "success",
-            "original_detected_raw": original_raw,
-            "original_key": original_key,
             "shifts": sorted(shifts_info, key=lambda x: x["semitone_shift"]),
-            "separated": separated_meta
+            "separated": separated_meta,
         })
+    except IngestError as e:
+        job.update(e.extra, status="error", message=str(e))
     except Exception as e:
+        logging.error(f"[{metrics.request_id()}] Error in ingest job {job_id}: {str(e)}", exc_info=True)
+        job.update(status="error", message=str(e))
+    save_job(job)
+
+def _job_progress(job: dict) -> dict:
+    per_version = 1 if job["mode"] == "separate_first" else 2
+    total = 1 + per_version * len(SHIFTS) + (1 if job["mode"] == "separate_first" else 0)
+    if FEATURE_SIDECARS:
+        total += len(SHIFTS)
+    return {"done": len(job["steps"]), "total": total}
+
+class IngestQueue:
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._active = 0
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest")
+        if os.path.isdir(INGEST_STATE_DIR):
+            for name in sorted(os.listdir(INGEST_STATE_DIR)):
+                job = load_job(name[:-5]) if name.endswith(".json") else None
+                if job is not None and job["status"] in ("queued", "running"):
+                    logging.info(f"Resuming ingest job {job['job_id']} after {len(job['steps'])} step(s)")
+                    self.submit(job["job_id"])
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _run(self, job_id: str):
+        try:
+            readiness.wait()
+            run_ingest_job(job_id)
+        finally:
+            with self._lock:
+                self._active -= 1
+                metrics.queue_depth("ingest", self._active)
+
+    def submit(self, job_id: str):
+        with self._lock:
+            self._active += 1
+            metrics.queue_depth("ingest", self._active)
+        self._executor.submit(self._run, job_id)
+
+ingest_queue = IngestQueue(INGEST_WORKERS)
+readiness = warmup.Readiness()
+
+@asynccontextmanager
+async def lifespan(app):
+    steps = [("separator", separator.load), ("pitch_pool", pitch_engine.start)]
+    if warmup.WARMUP:
+        steps.append(("key_detection", warm_up_key_detection))
+    startup = readiness.start(steps)
+    ingest_queue.start()
+    yield
+    ingest_queue.stop()
+    await startup
+    pitch_engine.stop()
+
+app = FastAPI(lifespan=lifespan)
+metrics.install(app, "shift_splitting")
+warmup.install(app, readiness)
+
+@app.post("/upload-song", status_code=202)
+async def upload_song(song: UploadFile, song_name: str = Form(...), mode: str = Form(None)):
+    mode = mode or INGEST_MODE
+    if mode not in INGEST_MODES:
+        return JSONResponse(status_code=400, content={"status": "error", "message": f"unknown ingest mode '{mode}', expected one of {list(INGEST_MODES)}"})
+    part_path = None
+    try:
+        song_dir = os.path.join(BASE_DIR, song_name)
+        os.makedirs(song_dir, exist_ok=True)
+        input_path = os.path.join(song_dir, f"{song_name}.mp3")
+        part_path = f"{input_path}.part"
+        input_hash = hashlib.sha256()
+        with open(part_path, "wb") as f:
+            while chunk := await song.read(UPLOAD_CHUNK_SIZE):
+                input_hash.update(chunk)
+                f.write(chunk)
+        os.replace(part_path, input_path)
+        part_path = None
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "song_name": song_name,
+            "input_path": input_path,
+            "input_sha256": input_hash.hexdigest(),
+            "mode": mode,
+            "request_id": metrics.request_id(),
+            "steps": [],
+            "created_at": time.time(),
+        }
+        save_job(job)
+        ingest_queue.submit(job["job_id"])
+        return JSONResponse(status_code=202, content={"status": "queued", "job_id": job["job_id"]})
+    except Exception as e:
+        logging.error(f"[{metrics.request_id()}] Error in upload-song: {str(e)}", exc_info=True)
         return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+    finally:
+        if part_path is not None and os.path.exists(part_path):
+            os.remove(part_path)
+
+@app.get("/upload-song/{job_id}")
+async def upload_song_status(job_id: str):
+    job = load_job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"unknown job '{job_id}'"})
+    content = {k: v for k, v in job.items() if k not in ("input_path", "input_sha256", "request_id")}
+    content["progress"] = _job_progress(job)
+    return JSONResponse(content=content)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8085)
\ No newline at end of file
@@ -0,0 +1,226 @@
+import numpy as np
+import librosa
+from numba import njit
+
+HPSS_KERNEL = 31
+
+
+@njit(cache=True)
+def _reflect_index(i, n):
+    while i < 0 or i >= n:
+        if i < 0:
+            i = -i - 1
+        else:
+            i = 2 * n - i - 1
+    return i
+
+
+@njit(cache=True)
+def _median_filter_rows(S, k):
+    n_rows, n = S.shape
+    h = k // 2
+    out = np.empty_like(S)
+    win = np.empty(k, dtype=S.dtype)
+    for r in range(n_rows):
+        for t in range(k):
+            win[t] = S[r, _reflect_index(t - h, n)]
+        win.sort()
+        out[r, 0] = win[h]
+        for c in range(1, n):
+            old = S[r, _reflect_index(c - 1 - h, n)]
+            new = S[r, _reflect_index(c + h, n)]
+            p = np.searchsorted(win, old)
+            if new >= old:
+                while p + 1 < k and win[p + 1] < new:
+                    win[p] = win[p + 1]
+                    p += 1
+            else:
+                while p > 0 and win[p - 1] > new:
+                    win[p] = win[p - 1]
+                    p -= 1
+            win[p] = new
+            out[r, c] = win[h]
+    return out
+
+
+def median_filter_time(S, k=HPSS_KERNEL):
+    return _median_filter_rows(np.ascontiguousarray(S), k)
+
+
+def median_filter_freq(S, k=HPSS_KERNEL):
+    return np.ascontiguousarray(_median_filter_rows(np.ascontiguousarray(S.T), k).T)
+
+
+def harmonic_spectrum(D, kernel_size=HPSS_KERNEL, power=2.0):
+    S = np.abs(D)
+    harm = median_filter_time(S, kernel_size)
+    perc = median_filter_freq(S, kernel_size)
+    mask_harm = librosa.util.softmask(harm, perc, power=power, split_zeros=True)
+    return D * mask_harm
+
+
+def pcm_blocks(path, sr, block_sec=10.0):
+    import soundfile as sf
+    import soxr
+    resampler = None
+    try:
+        f = sf.SoundFile(path)
+    except Exception:
+        f = None
+    if f is not None:
+        with f:
+            native_sr = f.samplerate
+            if native_sr != sr:
+                resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32")
+            block = max(1, int(block_sec * native_sr))
+            for data in f.blocks(blocksize=block, dtype="float32", always_2d=True):
+                y = data.mean(axis=1, dtype=np.float32)
+                yield resampler.resample_chunk(y) if resampler else y
+    else:
+        import audioread
+        with audioread.audio_open(path) as f:
+            native_sr, channels = f.samplerate, f.channels
+            if native_sr != sr:
+                resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32")
+            for buf in f:
+                y = np.frombuffer(buf, dtype="<i2").astype(np.float32) / 32768.0
+                y = y.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+                yield resampler.resample_chunk(y) if resampler else y
+    if resampler is not None:
+        yield resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+
+class BlockFramer:
+    def __init__(self, n_fft, hop):
+        self.n_fft = n_fft
+        self.hop = hop
+        self._buf = np.zeros(n_fft // 2, dtype=np.float32)
+
+    def push(self, y, last=False):
+        buf = np.concatenate((self._buf, np.asarray(y, dtype=np.float32)))
+        if last:
+            buf = np.concatenate((buf, np.zeros(self.n_fft // 2, dtype=np.float32)))
+        if len(buf) < self.n_fft:
+            self._buf = buf
+            return np.zeros((self.n_fft, 0), dtype=np.float32)
+        frames = librosa.util.frame(buf, frame_length=self.n_fft, hop_length=self.hop)
+        self._buf = buf[frames.shape[1] * self.hop:]
+        return frames
+
+
+class BlockHarmonic:
+    def __init__(self, kernel_size=HPSS_KERNEL):
+        self.kernel_size = kernel_size
+        self.h = kernel_size // 2
+        self._carry = None
+        self._started = False
+
+    def push(self, D, last=False):
+        ext = D if self._carry is None else np.concatenate((self._carry, D), axis=1)
+        start = self.h if self._started else 0
+        stop = ext.shape[1] if last else ext.shape[1] - self.h
+        if stop <= start:
+            self._carry = ext
+            return ext[:, :0]
+        harm = harmonic_spectrum(ext, self.kernel_size)[:, start:stop]
+        self._started = True
+        self._carry = ext[:, stop - self.h:]
+        return harm
+
+
+class ChunkedDenoiser:
+    def __init__(self, sr, total, chunk_size=600000, padding=30000, **nr_kwargs):
+        self.sr = sr
+        self.total = total
+        self.chunk_size = chunk_size
+        self.padding = padding
+        self.nr_kwargs = nr_kwargs
+        self._buf = np.zeros(padding, dtype=np.float32)
+        self._pos = 0
+
+    def push(self, y, last=False):
+        import noisereduce as nr
+        self._buf = np.concatenate((self._buf, np.asarray(y, dtype=np.float32)))
+        if self.total <= self.chunk_size:
+            seg_len = self.total + 2 * self.padding
+        else:
+            seg_len = self.chunk_size + 2 * self.padding
+        out = []
+        while self._pos < self.total and (len(self._buf) >= seg_len or last):
+            seg = self._buf[:seg_len]
+            if len(seg) < seg_len:
+                seg = np.concatenate((seg, np.zeros(seg_len - len(seg), dtype=np.float32)))
+            filtered = nr.reduce_noise(y=seg, sr=self.sr, chunk_size=seg_len, padding=0,
+                                       **self.nr_kwargs)
+            n_out = min(self.chunk_size, self.total - self._pos)
+            out.append(filtered[self.padding:self.padding + n_out])
+            self._buf = self._buf[self.chunk_size:]
+            self._pos += self.chunk_size
+        return np.concatenate(out) if out else np.zeros(0, dtype=np.float32)
+
+
+def _slice_blocks(blocks, start, end):
+    pos = 0
+    for y in blocks:
+        a, b = max(start - pos, 0), min(end - pos, len(y))
+        pos += len(y)
+        if a < b:
+            yield y[a:b]
+        if pos >= end:
+            break
+
+
+def trim_bounds(path, sr, n_fft, hop, top_db, block_sec=10.0):
+    framer = BlockFramer(n_fft, hop)
+    level, total = [], 0
+    for y in pcm_blocks(path, sr, block_sec):
+        total += len(y)
+        level.append(np.sqrt(np.mean(framer.push(y) ** 2, axis=0)))
+    level.append(np.sqrt(np.mean(framer.push(np.zeros(0, dtype=np.float32), last=True) ** 2, axis=0)))
+    level = np.concatenate(level)
+    if not level.size:
+        return 0, 0
+    db = librosa.amplitude_to_db(level, ref=np.max(level), top_db=None)
+    nonsilent = np.flatnonzero(db > -top_db)
+    if not nonsilent.size:
+        return 0, 0
+    start = int(librosa.frames_to_samples(nonsilent[0], hop_length=hop))
+    end = min(total, int(librosa.frames_to_samples(nonsilent[-1] + 1, hop_length=hop)))
+    return start, end
+
+
+def extract_features_blockwise(path, sr, n_fft, hop, trim_top_db, denoise=None, block_sec=10.0):
+    start, end = trim_bounds(path, sr, n_fft, hop, trim_top_db, block_sec)
+    if end <= start:
+        raise ValueError(f"no audio decoded from '{path}'")
+    window = librosa.filters.get_window("hann", n_fft, fftbins=True).astype(np.float32)
+    framer = BlockFramer(n_fft, hop)
+    harmonic = BlockHarmonic()
+    denoiser = ChunkedDenoiser(sr, end - start, **denoise) if denoise is not None else None
+    chroma_fb = None
+    chroma, rms, flatness = [], [], []
+
+    def consume(y, last=False):
+        nonlocal chroma_fb
+        if denoiser is not None:
+            y = denoiser.push(y, last=last)
+        frames = framer.push(y, last=last)
+        D = np.fft.rfft(frames * window[:, None], axis=0).astype(np.complex64)
+        if frames.shape[1]:
+            mag = np.abs(D)
+            rms.append(np.sqrt(np.mean(frames ** 2, axis=0)))
+            flatness.append(librosa.feature.spectral_flatness(S=mag)[0])
+        H = harmonic.push(D, last=last)
+        if H.shape[1]:
+            power = np.abs(H) ** 2
+            if chroma_fb is None:
+                tuning = librosa.estimate_tuning(S=power, sr=sr, bins_per_octave=12)
+                chroma_fb = librosa.filters.chroma(sr=sr, n_fft=n_fft, tuning=tuning)
+            chroma.append(librosa.util.normalize(chroma_fb @ power, norm=np.inf, axis=0))
+
+    for y in _slice_blocks(pcm_blocks(path, sr, block_sec), start, end):
+        consume(y)
+    consume(np.zeros(0, dtype=np.float32), last=True)
+    return (np.concatenate(chroma, axis=1).astype(np.float32),
+            np.concatenate(rms).astype(np.float32),
+            np.concatenate(flatness).astype(np.float32))
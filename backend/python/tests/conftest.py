@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+
+_scratch = tempfile.mkdtemp(prefix="singo-tests-")
+for name in ("FEATURE_CACHE_DIR", "PCM_CACHE_DIR", "KEY_CACHE_DIR", "BATCH_STATE_DIR"):
+    os.environ.setdefault(name, os.path.join(_scratch, name.lower()))
+os.environ.setdefault("SCORING_WORKERS", "1")
+os.environ.setdefault("KEY_WORKERS", "1")
+os.environ.setdefault("WARMUP", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from benchmark import write_fixtures
+
+
+@pytest.fixture(scope="session")
+def fixture_paths(tmp_path_factory):
+    return write_fixtures(str(tmp_path_factory.mktemp("fixtures")), ["30s"])
+
+
+@pytest.fixture(scope="session")
+def compare_client():
+    from fastapi.testclient import TestClient
+    import com5
+    with TestClient(com5.app) as client:
+        assert com5.readiness.wait(300)
+        yield client
@@ -0,0 +1,35 @@
+import json
+
+import com5
+
+
+def _batch(client, original, takes, job_id):
+    resp = client.post("/compare/batch", json={
+        "originalSongPath": original, "userSongPaths": takes, "jobId": job_id,
+    })
+    return resp, [json.loads(line) for line in resp.text.splitlines() if line]
+
+
+def test_batch_scores_every_take_through_the_pool(compare_client, fixture_paths):
+    takes = [fixture_paths["30s", "pitch"], fixture_paths["30s", "drift"]]
+    resp, lines = _batch(compare_client, fixture_paths["30s", "reference"], takes, "test-ok")
+    assert resp.status_code == 200
+    assert [line["type"] for line in lines] == ["start", "result", "result", "summary"]
+    assert {line["userSongPath"] for line in lines[1:3]} == set(takes)
+    assert lines[-1]["completed"] == 2
+    assert com5.scoring_pool.in_flight == 0
+
+
+def test_batch_missing_reference_is_404(compare_client, fixture_paths, tmp_path):
+    resp, _ = _batch(compare_client, str(tmp_path / "missing.wav"),
+                     [fixture_paths["30s", "pitch"]], "test-missing")
+    assert resp.status_code == 404
+
+
+def test_batch_unreadable_reference_reports_error(compare_client, fixture_paths, tmp_path):
+    broken = tmp_path / "broken.wav"
+    broken.write_bytes(b"not audio")
+    resp, lines = _batch(compare_client, str(broken), [fixture_paths["30s", "pitch"]], "test-broken")
+    assert [line["type"] for line in lines] == ["start", "error", "summary"]
+    assert lines[-1]["failed"] == 1
+    assert com5.scoring_pool.in_flight == 0
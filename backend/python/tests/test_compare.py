@@ -0,0 +1,23 @@
+import pytest
+
+import com5
+
+
+def _compare(client, fixture_paths, **extra):
+    return client.post("/compare", json=dict({
+        "originalSongPath": fixture_paths["30s", "reference"],
+        "userSongPath": fixture_paths["30s", "pitch"],
+    }, **extra))
+
+
+def test_compare_reports_configured_align_mode(compare_client, fixture_paths):
+    resp = _compare(compare_client, fixture_paths)
+    assert resp.status_code == 200
+    assert resp.json()["data"]["alignMode"] == com5.ALIGN_MODE
+
+
+@pytest.mark.parametrize("align_mode", ["segment", "beat"])
+def test_compare_reports_requested_align_mode(compare_client, fixture_paths, align_mode):
+    resp = _compare(compare_client, fixture_paths, alignMode=align_mode)
+    assert resp.status_code == 200
+    assert resp.json()["data"]["alignMode"] == align_mode
@@ -0,0 +1,34 @@
+import pytest
+
+import com5
+from dtw_engine import ENGINES
+
+# The banded engine is exact inside its band while fastdtw approximates the full grid, so its
+# normalized distance may only come out lower; allow 1% above fastdtw for band clipping.
+DISTANCE_TOLERANCE = 0.01
+# Mistake spans follow the warping path, and through long wrong-note stretches the two engines
+# settle on different paths of near-equal cost: 63 vs 54 mistakes on the 3-minute pitch fixture.
+MISTAKE_TOLERANCE = 0.2
+
+
+@pytest.fixture(scope="module")
+def parity_fixtures(tmp_path_factory):
+    from benchmark import write_fixtures
+    return write_fixtures(str(tmp_path_factory.mktemp("parity")), ["30s", "3min"])
+
+
+@pytest.mark.parametrize("label", ["30s", "3min"])
+@pytest.mark.parametrize("scenario", ["pitch", "drift"])
+def test_banded_matches_fastdtw(parity_fixtures, monkeypatch, label, scenario):
+    original, user = parity_fixtures[label, "reference"], parity_fixtures[label, scenario]
+    A = com5.extract_chroma_from_song(original)[3]
+    B = com5.extract_chroma_from_song(user)[3]
+    results = {}
+    for engine in ENGINES:
+        monkeypatch.setattr(com5, "DTW_ENGINE", engine)
+        nd, _ = com5.dtw_normalized_distance(A, B, com5.ALPHA, align_mode="full")
+        mistakes = com5.score_recording(original, user, "full")["data"]["mistakes"]
+        results[engine] = nd, len(mistakes)
+    (banded_nd, banded_mistakes), (fast_nd, fast_mistakes) = results["banded"], results["fastdtw"]
+    assert banded_nd <= fast_nd * (1 + DISTANCE_TOLERANCE)
+    assert abs(banded_mistakes - fast_mistakes) <= max(2, MISTAKE_TOLERANCE * fast_mistakes)
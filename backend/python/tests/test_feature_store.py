@@ -0,0 +1,35 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+
+from feature_store import FeatureSet, ReferenceFeatureStore, load_feature_dir, save_feature_dir
+
+
+def test_saved_feature_dir_follows_umask(tmp_path):
+    old = os.umask(0o022)
+    try:
+        target = tmp_path / "features"
+        save_feature_dir(str(target), FeatureSet({"a": np.arange(3)}, {}))
+    finally:
+        os.umask(old)
+    assert stat.S_IMODE(target.stat().st_mode) == 0o755
+    assert list(load_feature_dir(str(target))["a"]) == [0, 1, 2]
+    assert os.listdir(tmp_path) == ["features"]
+
+
+def test_failed_compute_releases_key_lock(tmp_path):
+    store = ReferenceFeatureStore(str(tmp_path / "cache"), "v1", 1 << 20)
+    source = tmp_path / "song.wav"
+    source.write_bytes(b"\0")
+
+    def compute(path):
+        raise ValueError("decode failed")
+
+    with pytest.raises(ValueError):
+        store.get(str(source), compute)
+    assert store._key_locks == {}
+    features = store.get(str(source), lambda path: FeatureSet({"a": np.zeros(2)}, {}))
+    assert list(features["a"]) == [0.0, 0.0]
+    assert store._key_locks == {}
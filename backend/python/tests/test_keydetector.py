@@ -0,0 +1,34 @@
+import os
+import json
+import signal
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def key_client():
+    from fastapi.testclient import TestClient
+    import KeyDetector
+    with TestClient(KeyDetector.app) as client:
+        assert KeyDetector.readiness.wait(300)
+        yield client
+
+
+def _batch(client, paths):
+    resp = client.post("/keydetect/batch", json={"paths": paths})
+    assert resp.status_code == 200
+    return [json.loads(line) for line in resp.text.splitlines() if line]
+
+
+def test_key_pool_recovers_after_worker_is_killed(key_client, fixture_paths):
+    import KeyDetector
+    path = fixture_paths["30s", "reference"]
+    for pid in list(KeyDetector.key_pool._executor._processes):
+        os.kill(pid, signal.SIGKILL)
+    lines = _batch(key_client, [path])
+    assert [line["type"] for line in lines] == ["start", "result", "summary"]
+    assert lines[1]["status"] == 503
+    assert lines[-1]["failed"] == 1
+    lines = _batch(key_client, [path])
+    assert lines[1]["status"] == 200
+    assert lines[1]["detectedKey"]
@@ -0,0 +1,91 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+
+import numpy as np
+
+import metrics
+
+WARMUP = os.environ.get("WARMUP", "1") == "1"
+WARMUP_SEC = float(os.environ.get("WARMUP_SEC", "5.0"))
+# Read by numba when librosa is first imported, so importers must load this module before librosa.
+NUMBA_CACHE_DIR = os.environ.setdefault("NUMBA_CACHE_DIR", "numba_cache")
+
+
+def synthetic_voice(sr, seconds=WARMUP_SEC, transpose=0):
+    # Stepped melody with vibrato and a little noise, so the gates and feature paths do real work.
+    n = int(sr * seconds)
+    t = np.arange(n) / sr
+    degrees = np.array([0, 2, 4, 5, 7, 9, 7, 4])
+    midi = 57 + transpose + degrees[(t * 2).astype(np.int64) % len(degrees)]
+    f0 = 440.0 * 2 ** ((midi - 69) / 12) * (1 + 0.01 * np.sin(2 * np.pi * 5.5 * t))
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    y = 0.1 * sum(np.sin(k * phase) / k for k in range(1, 6))
+    y += 0.003 * np.random.default_rng(0).standard_normal(n)
+    return y.astype(np.float32)
+
+
+def warm_worker(fn, *args):
+    if not WARMUP:
+        return
+    t0 = time.perf_counter()
+    try:
+        with metrics.collect():
+            fn(*args)
+        logging.info(f"Worker {os.getpid()} warmed up in {time.perf_counter() - t0:.2f}s")
+    except Exception as e:
+        logging.warning(f"Worker {os.getpid()} warm-up failed, it will start cold: {str(e)}")
+
+
+class Readiness:
+    def __init__(self):
+        self.state = "starting"
+        self.message = None
+        self.timings = {}
+        self._done = threading.Event()
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def run(self, steps):
+        self.state = "warming"
+        name = None
+        try:
+            with metrics.collect():
+                for name, fn in steps:
+                    t0 = time.perf_counter()
+                    fn()
+                    self.timings[name] = round(time.perf_counter() - t0, 3)
+                    logging.info(f"Startup step {name} finished in {self.timings[name]:.2f}s")
+            self.state = "ready"
+        except Exception as e:
+            logging.error(f"Startup step {name} failed: {str(e)}", exc_info=True)
+            self.state, self.message = "failed", str(e)
+        finally:
+            self._done.set()
+        return self.ready
+
+    def start(self, steps):
+        return asyncio.get_running_loop().run_in_executor(None, self.run, list(steps))
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.ready
+
+
+def install(app, readiness):
+    from fastapi.responses import JSONResponse
+
+    @app.get("/health", include_in_schema=False)
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/ready", include_in_schema=False)
+    async def ready():
+        content = {"status": readiness.state, "startup": readiness.timings}
+        if readiness.message:
+            content["message"] = readiness.message
+        return JSONResponse(status_code=200 if readiness.ready else 503, content=content)
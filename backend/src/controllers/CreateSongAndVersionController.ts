@@ -5,6 +5,84 @@ import * as fs from "fs";
 import path = require("path");
 import axios from "axios";
 
+const SHIFT_SPLIT_API = "http://localhost:8085";
+const INGEST_RECORD_DIR = path.join(process.cwd(), "data", "uploads", "ingest");
+const JOB_ID_PATTERN = /^[A-Za-z0-9_-]+$/;
+
+// What the status poll needs to create the song once the ingest job finishes.
+type IngestRecord = {
+  jobId: string;
+  songName: string;
+  singer: string;
+  album_cover: string | null;
+  previewsong: string | null;
+  song?: any;
+  createdShifts?: number[];
+  versions?: any[];
+};
+
+const ingestRecordPath = (jobId: string) => path.join(INGEST_RECORD_DIR, `${jobId}.json`);
+
+const readIngestRecord = (jobId: string): IngestRecord | null => {
+  if (!JOB_ID_PATTERN.test(jobId)) {
+    return null;
+  }
+  try {
+    return JSON.parse(fs.readFileSync(ingestRecordPath(jobId), "utf-8"));
+  } catch {
+    return null;
+  }
+};
+
+const writeIngestRecord = (record: IngestRecord) => {
+  fs.mkdirSync(INGEST_RECORD_DIR, { recursive: true });
+  const recordPath = ingestRecordPath(record.jobId);
+  fs.writeFileSync(`${recordPath}.tmp`, JSON.stringify(record));
+  fs.renameSync(`${recordPath}.tmp`, recordPath);
+};
+
+// Overlapping polls share one finalize per job; progress is saved after every
+// insert so a retry after a failure never creates the song or a version twice.
+const finalizing = new Map<string, Promise<IngestRecord>>();
+
+const finalizeIngest = async (record: IngestRecord, result: any) => {
+  if (!record.song) {
+    record.song = await createSong(
+      record.songName,
+      result.original_key,
+      record.singer,
+      record.album_cover,
+      record.previewsong
+    );
+    record.createdShifts = [];
+    writeIngestRecord(record);
+  }
+
+  for (const item of result.separated) {
+    if (item.status !== "done" || record.createdShifts!.includes(item.semitone_shift)) {
+      continue;
+    }
+    try {
+      await createVersion(
+        record.song.song_id,
+        item.instru_path,
+        item.vocal_path,
+        item.key,
+        item.semitone_shift,
+        item.is_original
+      );
+    } catch (e) {
+      throw new Error(`Error creating version: ${e}`);
+    }
+    record.createdShifts!.push(item.semitone_shift);
+    writeIngestRecord(record);
+  }
+
+  record.versions = result.separated;
+  writeIngestRecord(record);
+  return record;
+};
+
 export const CreateSongAndVersionController = async (c: Context) => {
   try {
     const formData = await c.req.formData();
@@ -49,66 +127,97 @@ export const CreateSongAndVersionController = async (c: Context) => {
     backendForm.append("song", song);
     backendForm.append("song_name", song_name);
 
-    let result;
+    let jobId: string;
     try {
       const response = await axios.post(
-        "http://localhost:8085/upload-song",
+        `${SHIFT_SPLIT_API}/upload-song`,
         backendForm,
         {
-          timeout: 1800000, // 30 minutes
+          timeout: 600000, // 10 minutes for the upload itself
           maxContentLength: Infinity,
           maxBodyLength: Infinity,
         }
       );
-      result = response.data;
+      jobId = response.data.job_id;
     } catch (error: any) {
       console.error("Error calling shift-splitting API:", error.message);
-      return c.json(ConstructResponse(false, `Shift-splitting API error: ${error.message}`, 500));
+      return c.json(ConstructResponse(false, `Shift-splitting API error: ${error.message}`), 500);
+    }
+
+    if (!jobId || !JOB_ID_PATTERN.test(jobId)) {
+      return c.json(ConstructResponse(false, "Shift-splitting API returned no job id"), 500);
     }
 
-    if (!result || result.status !== "success") {
+    writeIngestRecord({ jobId, songName, singer, album_cover, previewsong });
+
+    // Separation runs for minutes; the client polls /uploadsong/status with this id.
+    return c.json(ConstructResponse(true, "Song ingest started", { job_id: jobId, status: "queued" }), 202);
+  } catch (e) {
+    console.error("Execution error:", e);
+    console.error("222222222222222222222222222222222222222222222222222222222222222222222222222222222222");
+    return c.json(ConstructResponse(false, `Error: ${e}`), 500);
+  }
+};
+
+export const UploadSongStatusController = async (c: Context) => {
+  try {
+    const { jobId } = await c.req.json<{ jobId: string }>();
+    if (!jobId) {
+      return c.json(ConstructResponse(false, "Missing jobId"), 400);
+    }
+
+    const record = readIngestRecord(jobId);
+    if (!record) {
+      return c.json(ConstructResponse(false, `Unknown ingest job '${jobId}'`), 404);
+    }
+    if (record.versions) {
       return c.json(
-        ConstructResponse(false, result?.message || "Error from split API", 400)
+        ConstructResponse(true, "Song and versions created successfully", {
+          song: record.song,
+          versions: record.versions,
+        }),
+        200
       );
     }
 
-    const songRecord = await createSong(
-      songName,
-      result.original_key,
-      singer,
-      album_cover,
-      previewsong
-    );
+    let result;
+    try {
+      ({ data: result } = await axios.get(`${SHIFT_SPLIT_API}/upload-song/${jobId}`, { timeout: 30000 }));
+    } catch (error: any) {
+      console.error("Error calling shift-splitting API:", error.message);
+      return c.json(ConstructResponse(false, `Shift-splitting API error: ${error.message}`), 500);
+    }
 
-    for (const item of result.separated) {
-      if (item.status === "done") {
-        // Save correct relative paths in DB (match the actual file extension)
-        try {
-          await createVersion(
-          songRecord.song_id,
-          item.instru_path,
-          item.vocal_path,
-          item.key,
-          item.semitone_shift,
-          item.is_original
-        );}
-        catch (e) {
-          console.error("Error creating version:", e);
-          console.error("111111111111111111111111111111111111111111111111111111111111111111111111111111111111");
-          return c.json(ConstructResponse(false, `Error creating version: ${e}`), 500);
-      }
+    if (result.status === "error") {
+      return c.json(ConstructResponse(false, result.message || "Error from split API"), 400);
     }
+    if (result.status !== "success") {
+      return c.json(
+        ConstructResponse(true, "Song ingest in progress", {
+          job_id: jobId,
+          status: result.status,
+          progress: result.progress,
+        }),
+        202
+      );
+    }
+
+    let pending = finalizing.get(jobId);
+    if (!pending) {
+      pending = finalizeIngest(record, result).finally(() => finalizing.delete(jobId));
+      finalizing.set(jobId, pending);
     }
-  
+    const done = await pending;
+
     return c.json(
       ConstructResponse(true, "Song and versions created successfully", {
-        song: songRecord,
-        versions: result.separated,
-      })
+        song: done.song,
+        versions: done.versions,
+      }),
+      200
     );
   } catch (e) {
     console.error("Execution error:", e);
-    console.error("222222222222222222222222222222222222222222222222222222222222222222222222222222222222");
     return c.json(ConstructResponse(false, `Error: ${e}`), 500);
   }
 };
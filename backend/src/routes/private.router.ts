@@ -8,7 +8,7 @@ import { DisplayMistakesController } from "../controllers/Mistake";
 import { HistoryController } from "../controllers/History";
 import { UserController } from "../controllers/User";
 import { uploadRecordAndScoreController } from "../controllers/uploadRecord";
-import { CreateSongAndVersionController } from "../controllers/CreateSongAndVersionController";
+import { CreateSongAndVersionController, UploadSongStatusController } from "../controllers/CreateSongAndVersionController";
 import { updateProfilePicController, updateUserController } from "../controllers/Profile";
 import { AddLyricController, GetLyricController } from "../controllers/Lyrics";
 
@@ -29,6 +29,7 @@ privateRouter.get("/getuser", UserController);
 privateRouter.post("/getaudiobyid", getAudioVerByIdController);
 privateRouter.post("/uploaduserrecord", uploadRecordAndScoreController);
 privateRouter.post("/uploadsong", CreateSongAndVersionController);
+privateRouter.post("/uploadsong/status", UploadSongStatusController);
 privateRouter.post("/updatepic", updateProfilePicController);
 privateRouter.post("/updateuser", updateUserController);
 privateRouter.post("/addlyric", AddLyricController);